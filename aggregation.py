@@ -0,0 +1,315 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from datasets import read_csv_typed
+
+#Marks a count cell that has never been seen, large so that taking the minimum of first positions just works
+never_seen = np.iinfo(np.int64).max
+
+#Rows counted at a time when a whole frame is counted, only one slice's temporary keys exist at once
+count_slice_rows = 1_000_000
+
+def column_codes(values, narrow=False):
+    #Integer codes and labels for a column, categorical columns reuse their own codes
+    #Missing values get the code -1, narrow=True keeps a categorical's own small code dtype
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        return (codes if narrow else codes.astype(np.int64)), list(values.cat.categories)
+    codes, uniques = pd.factorize(values)
+    return codes.astype(np.int64, copy=False), list(uniques)
+
+def money_values(values):
+    #Prices as float64 ready for summing, missing values count as zero like in a groupby sum
+    #float32 columns from the typed schemas are rounded back to the cent they were written with
+    array = np.asarray(values)
+    if array.dtype == np.float32:
+        return np.nan_to_num(np.round(array.astype(np.float64), 2))
+    return np.nan_to_num(array.astype(np.float64))
+
+def discount_value_codes(values):
+    #Codes into the sorted distinct discounts, -1 for a missing discount, and the discounts themselves
+    #Labels are int64 whenever every discount is a whole number, so the float32 schema column (which
+    #can hold blanks) gives the same labels as a plain integer column and sums cannot overflow
+    values = np.asarray(values)
+    present = ~pd.isna(values)
+    discounts, codes = np.unique(values[present], return_inverse=True)
+    if discounts.dtype.kind in 'iu' or (discounts.dtype.kind == 'f' and np.array_equal(discounts, np.round(discounts))):
+        discounts = discounts.astype(np.int64)
+    elif discounts.dtype.kind == 'f':
+        discounts = discounts.astype(np.float64)
+    out = np.full(len(values), -1, dtype=np.int64)
+    out[present] = codes
+    return out, discounts
+
+def first_positions(keys, size, offset=0):
+    #Row position where each key in range(size) first appears, keys of -1 are skipped
+    #pd.factorize numbers keys in order of appearance, so the running maximum of its codes
+    #steps up exactly at the row where a new key shows up for the first time
+    positions = np.full(size, never_seen, dtype=np.int64)
+    if len(keys) == 0:
+        return positions
+
+    order, uniques = pd.factorize(keys)
+    running = np.maximum.accumulate(order)
+    found = np.searchsorted(running, np.arange(len(uniques)))
+
+    valid = uniques >= 0
+    positions[uniques[valid]] = found[valid] + offset
+    return positions
+
+def _pair_counts(category_codes, other_codes, num_categories, num_other, offset):
+    #Counts and first positions for every (category, other) pair in one bincount
+    present = (category_codes >= 0) & (other_codes >= 0)
+    keys = np.where(present, category_codes * num_other + other_codes, -1)
+
+    counts = np.bincount(keys[present], minlength=num_categories * num_other)
+    first = first_positions(keys, num_categories * num_other, offset)
+    return counts.reshape(num_categories, num_other), first.reshape(num_categories, num_other)
+
+def count_codes(category_codes, categories, segment_codes, segments, state_codes, states, offset=0):
+    #Builds the count tables from already encoded columns, offset is the position of the first row
+    #in the full dataset so first positions stay comparable between chunks
+    #Narrow codes (int8 from a memory-mapped file) are widened so the pair keys cannot overflow
+    category_codes = np.asarray(category_codes, dtype=np.int64)
+    segment_codes = np.asarray(segment_codes, dtype=np.int64)
+    state_codes = np.asarray(state_codes, dtype=np.int64)
+    num_categories = len(categories)
+    present = category_codes >= 0
+
+    segment_counts, segment_first = _pair_counts(category_codes, segment_codes, num_categories, len(segments), offset)
+    state_counts, state_first = _pair_counts(category_codes, state_codes, num_categories, len(states), offset)
+
+    return {
+        'rows': len(category_codes),
+        'categories': list(categories),
+        'segments': list(segments),
+        'states': list(states),
+        'category_totals': np.bincount(category_codes[present], minlength=num_categories),
+        'category_first': first_positions(category_codes, num_categories, offset),
+        'segment_counts': segment_counts,
+        'segment_first': segment_first,
+        'state_counts': state_counts,
+        'state_first': state_first
+    }
+
+def count_segments_states(df, category_col='Category', segment_col='Customer_Segment',
+                          state_col='Customer_State', offset=0):
+    #Single grouped pass over the frame that counts segments and states for every category at once
+    #state_col=None leaves the state table empty, for callers that track states some other way
+    category_codes, categories = column_codes(df[category_col], narrow=True)
+    segment_codes, segments = column_codes(df[segment_col], narrow=True)
+    if state_col is None:
+        state_codes, states = np.full(len(df), -1, dtype=np.int8), []
+    else:
+        state_codes, states = column_codes(df[state_col], narrow=True)
+
+    #Large frames are counted slice by slice and merged, which keeps the widened keys to one slice
+    counts = None
+    for start in range(0, max(len(df), 1), count_slice_rows):
+        stop = start + count_slice_rows
+        partial = count_codes(category_codes[start:stop], categories, segment_codes[start:stop], segments,
+                              state_codes[start:stop], states, offset)
+        counts = partial if counts is None else merge_counts(counts, partial)
+    return counts
+
+def _ranked(counts, first):
+    #Indexes with a non zero count, highest count first and ties in order of first appearance
+    #This is the same order value_counts gives since it sorts stably from first appearance
+    order = np.lexsort((first, -counts))
+    return order[counts[order] > 0]
+
+def build_results(counts, top_n=5):
+    #Turns count tables into the results dict consumed by predict_segment_and_state
+    results = {}
+
+    category_first = counts['category_first']
+    for c in np.argsort(category_first, kind='stable'):
+        if category_first[c] == never_seen:
+            break
+
+        total_category_records = int(counts['category_totals'][c])
+
+        segment_counts = counts['segment_counts'][c]
+        segment_probabilities = {
+            counts['segments'][s]: segment_counts[s] / total_category_records
+            for s in _ranked(segment_counts, counts['segment_first'][c])
+        }
+
+        state_counts = counts['state_counts'][c]
+        top_states = _ranked(state_counts, counts['state_first'][c])[:top_n]
+        state_percentages = np.round(state_counts[top_states] / total_category_records * 100, 2)
+
+        results[counts['categories'][c]] = {
+            'total_records': total_category_records,
+            'segment_probabilities': {segment: float(p) for segment, p in segment_probabilities.items()},
+            'top5_states': [
+                {'state': counts['states'][s], 'count': state_counts[s], 'percentage': f"{percentage}%"}
+                for s, percentage in zip(top_states, state_percentages)
+            ]
+        }
+
+    return results
+
+def segment_state_results(df, category_col='Category', segment_col='Customer_Segment',
+                          state_col='Customer_State', top_n=5):
+    #Segment probabilities and top states for every category, computed from one set of count tables
+    counts = count_segments_states(df, category_col, segment_col, state_col)
+    return build_results(counts, top_n)
+
+def count_revenue(df, category_col='Category', discount_col='Discount (%)', revenue_col='Final_Price(Rs.)', offset=0):
+    #Revenue and order counts for every (category, discount) pair, discounts are kept sorted like groupby does
+    category_codes, categories = column_codes(df[category_col])
+    return count_revenue_codes(category_codes, categories, df[discount_col].to_numpy(), df[revenue_col], offset)
+
+def count_revenue_codes(category_codes, categories, discount_values, revenue_values, offset=0):
+    #Same tables as count_revenue from an encoded category column and plain discount and revenue arrays
+    category_codes = np.asarray(category_codes, dtype=np.int64)
+    discount_codes, discounts = discount_value_codes(discount_values)
+
+    num_discounts = len(discounts)
+    present = (category_codes >= 0) & (discount_codes >= 0)
+    keys = category_codes[present] * num_discounts + discount_codes[present]
+    revenue_values = money_values(revenue_values)[present]
+    size = len(categories) * num_discounts
+
+    return {
+        'rows': len(category_codes),
+        'categories': list(categories),
+        'discounts': list(discounts),
+        'category_first': first_positions(category_codes, len(categories), offset),
+        'revenue': np.bincount(keys, weights=revenue_values, minlength=size).reshape(len(categories), num_discounts),
+        'orders': np.bincount(keys, minlength=size).reshape(len(categories), num_discounts),
+        #Sum of squared order values per pair, lets the bootstrap resample revenue without the raw rows
+        'revenue_squares': np.bincount(keys, weights=revenue_values ** 2, minlength=size).reshape(len(categories), num_discounts)
+    }
+
+def optimal_from_revenue(counts):
+    #Picks the discount with the most revenue for each category, ties go to the lowest discount like idxmax
+    optimal_discounts = {}
+
+    #Pairs that never occurred are not candidates, same as groupby only producing observed pairs
+    revenue = np.where(counts['orders'] > 0, counts['revenue'], -np.inf)
+    best = np.argmax(revenue, axis=1)
+
+    category_first = counts['category_first']
+    for c in np.argsort(category_first, kind='stable'):
+        if category_first[c] == never_seen:
+            break
+        if counts['orders'][c].any():
+            optimal_discounts[counts['categories'][c]] = counts['discounts'][best[c]]
+
+    return optimal_discounts
+
+#Which label list each table is indexed by, used to line tables up when merging
+_table_axes = {
+    'category_totals': ('categories',),
+    'category_first': ('categories',),
+    'segment_counts': ('categories', 'segments'),
+    'segment_first': ('categories', 'segments'),
+    'state_counts': ('categories', 'states'),
+    'state_first': ('categories', 'states'),
+    'revenue': ('categories', 'discounts'),
+    'orders': ('categories', 'discounts'),
+    'revenue_squares': ('categories', 'discounts')
+}
+_sorted_labels = {'discounts'}
+
+def _union_labels(name, a, b):
+    seen = set(a)
+    labels = list(a) + [label for label in b if label not in seen]
+    return sorted(labels) if name in _sorted_labels else labels
+
+def _reindex(table, axes, old_labels, new_labels, fill):
+    #Places a table into the merged label space, cells it did not have get the fill value
+    shape = tuple(len(new_labels[axis]) for axis in axes)
+    out = np.full(shape, fill, dtype=table.dtype)
+    positions = []
+    for axis in axes:
+        lookup = {label: i for i, label in enumerate(new_labels[axis])}
+        positions.append(np.array([lookup[label] for label in old_labels[axis]], dtype=np.int64))
+    out[np.ix_(*positions)] = table
+    return out
+
+def merge_counts(a, b):
+    #Combines two count accumulators of the same kind as if b's rows had been appended after a's
+    #Counts and revenue are added, first positions keep the earliest one with b shifted by a's row count
+    label_names = [name for name in ('categories', 'segments', 'states', 'discounts') if name in a]
+    new_labels = {name: _union_labels(name, a[name], b[name]) for name in label_names}
+
+    merged = {'rows': a['rows'] + b['rows']}
+    merged.update(new_labels)
+
+    for name, axes in _table_axes.items():
+        if name not in a or name not in b: #Tables only one side has, like ones added to an older saved state, are dropped
+            continue
+        is_first = name.endswith('_first')
+        fill = never_seen if is_first else 0
+        left = _reindex(a[name], axes, a, new_labels, fill)
+        right = _reindex(b[name], axes, b, new_labels, fill)
+        if is_first:
+            right = np.where(right == never_seen, never_seen, right + a['rows'])
+            merged[name] = np.minimum(left, right)
+        else:
+            merged[name] = left + right
+
+    return merged
+
+def counts_to_dict(counts):
+    #Plain JSON friendly form of an accumulator
+    out = {}
+    for key, value in counts.items():
+        if isinstance(value, np.ndarray):
+            out[key] = {'dtype': str(value.dtype), 'shape': list(value.shape), 'values': value.ravel().tolist()}
+        elif isinstance(value, list):
+            out[key] = [label.item() if isinstance(label, np.generic) else label for label in value]
+        else:
+            out[key] = value
+    return out
+
+def counts_from_dict(data):
+    counts = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            counts[key] = np.array(value['values'], dtype=value['dtype']).reshape(value['shape'])
+        elif key == 'discounts':
+            counts[key] = list(np.array(value)) #Keeps numpy scalars so results match the in memory path
+        else:
+            counts[key] = value
+    return counts
+
+def counts_to_json(counts):
+    #Serializes an accumulator so partial results can be stored or shipped between machines
+    return json.dumps(counts_to_dict(counts))
+
+def counts_from_json(text):
+    return counts_from_dict(json.loads(text))
+
+def save_counts(counts, path):
+    with open(path, 'w') as handle:
+        handle.write(counts_to_json(counts))
+
+def load_counts(path):
+    with open(path) as handle:
+        return counts_from_json(handle.read())
+
+def stream_counts(chunks, count_chunk):
+    #Folds count_chunk over an iterable of DataFrames, memory only depends on the chunk size
+    total = None
+    for chunk in chunks:
+        partial = count_chunk(chunk)
+        total = partial if total is None else merge_counts(total, partial)
+    return total
+
+def stream_segment_state_counts(data_path, category_col='Category', segment_col='Customer_Segment',
+                                state_col='Customer_State', chunksize=1_000_000, schema=None):
+    #Reads the CSV in chunks and accumulates the segment and state count tables
+    chunks = read_csv_typed(data_path, schema, [category_col, segment_col, state_col], chunksize)
+    return stream_counts(chunks, lambda chunk: count_segments_states(chunk, category_col, segment_col, state_col))
+
+def stream_revenue_counts(data_path, category_col='Category', discount_col='Discount (%)',
+                          revenue_col='Final_Price(Rs.)', chunksize=1_000_000, schema=None):
+    #Reads the CSV in chunks and accumulates revenue per category and discount
+    chunks = read_csv_typed(data_path, schema, [category_col, discount_col, revenue_col], chunksize)
+    return stream_counts(chunks, lambda chunk: count_revenue(chunk, category_col, discount_col, revenue_col))
@@ -0,0 +1,350 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import synthetic_data
+from aggregation import segment_state_results
+from sketches import CategorySketches
+
+def _time_call(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def benchmark_generation(sizes=(10_000, 100_000, 1_000_000), loop_limit=100_000, seed=0):
+    #Compares rows per second of the original loop generator against the vectorized one
+    rows = []
+    for size in sizes:
+        vectorized_seconds, _ = _time_call(synthetic_data.generate_synthetic_data, size, seed=seed)
+
+        loop_seconds = None
+        if size <= loop_limit: #The loop gets too slow to be worth timing on the big sizes
+            loop_seconds, _ = _time_call(synthetic_data.generate_synthetic_data_loop, size)
+
+        rows.append({
+            'records': size,
+            'loop_rows_per_sec': size / loop_seconds if loop_seconds else None,
+            'vectorized_rows_per_sec': size / vectorized_seconds,
+            'speedup': loop_seconds / vectorized_seconds if loop_seconds else None
+        })
+    return rows
+
+def print_generation_results(rows):
+    print("{:<12} {:>18} {:>22} {:>10}".format("Records", "Loop rows/s", "Vectorized rows/s", "Speedup"))
+    print("-" * 65)
+    for row in rows:
+        loop = f"{row['loop_rows_per_sec']:,.0f}" if row['loop_rows_per_sec'] else "skipped"
+        speedup = f"{row['speedup']:.1f}x" if row['speedup'] else "-"
+        print("{:<12} {:>18} {:>22} {:>10}".format(
+            f"{row['records']:,}", loop, f"{row['vectorized_rows_per_sec']:,.0f}", speedup
+        ))
+
+#Each loading strategy runs in a fresh interpreter so its peak RSS is not hidden by an earlier one
+memory_scenarios = {
+    'imports only': "import pandas as pd",
+    'bare read_csv': "import pandas as pd; df = pd.read_csv(path)",
+    'typed, all columns': "from datasets import read_csv_typed, {schema}; df = read_csv_typed(path, {schema})",
+    'typed, analysis columns': "from datasets import read_csv_typed, {schema}; df = read_csv_typed(path, {schema}, {columns})",
+    'entry point, cold cache': "import shutil; from datasets import default_cache_dir; {entry_point}; "
+                               "shutil.rmtree(default_cache_dir(path), ignore_errors=True); run(path)",
+    'entry point, warm cache': "{entry_point}; run(path)" #Runs right after the cold scenario built the cache
+}
+
+#Analysis entry point each schema's dataset is loaded by, through load_dataset and its cache
+memory_entry_points = {
+    'synthetic_schema': "from prediction import analyze_synthetic_data as run",
+    'transaction_schema': "from optimal_discount import find_optimal_discounts as run"
+}
+
+def peak_rss_mb(code, data_path):
+    #Runs code in a child interpreter with path set and returns its peak resident set size in MB
+    script = f"import resource\npath = {data_path!r}\n{code}\nprint(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+    output = subprocess.run(
+        [sys.executable, '-c', script], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    return int(output.stdout.split()[-1]) / 1024 #ru_maxrss is reported in KB on Linux
+
+def benchmark_memory(data_path, schema='synthetic_schema', columns=('Category', 'Customer_Segment', 'Customer_State')):
+    #Peak RSS of loading data_path with a bare read_csv compared to the typed, pruned loader and to the
+    #analysis entry point reading through a cache it has to build (cold) or can reuse (warm)
+    rows = []
+    for name, code in memory_scenarios.items():
+        code = code.format(schema=schema, columns=list(columns), entry_point=memory_entry_points[schema])
+        rows.append({'scenario': name, 'peak_rss_mb': peak_rss_mb(code, data_path)})
+    return rows
+
+def print_memory_results(rows):
+    baseline = next(row['peak_rss_mb'] for row in rows if row['scenario'] == 'bare read_csv')
+    print("{:<26} {:>14} {:>12}".format("Scenario", "Peak RSS (MB)", "vs bare"))
+    print("-" * 54)
+    for row in rows:
+        print("{:<26} {:>14,.0f} {:>11.1f}x".format(row['scenario'], row['peak_rss_mb'], baseline / row['peak_rss_mb']))
+
+def _zipf_keys(num_records, num_keys, seed):
+    #Synthetic orders keyed by something like a ZIP code, a few keys are common and the tail is very long
+    rng = np.random.default_rng(seed)
+    categories = np.array(synthetic_data.categories)
+    keys = (rng.zipf(1.2, num_records) - 1) % num_keys
+    return pd.DataFrame({
+        'Category': categories[rng.integers(0, len(categories), num_records)],
+        'Customer_Segment': np.array(synthetic_data.customer_segments)[rng.integers(0, 3, num_records)],
+        'Key': pd.Series(keys).map(lambda key: f"{key:05d}").to_numpy()
+    })
+
+def benchmark_sketch(num_records=2_000_000, num_keys=100_000, capacities=(16, 64, 256), chunk_size=250_000, seed=0):
+    #Exact top 5 keys per category against Space-Saving sketches of several sizes
+    df = _zipf_keys(num_records, num_keys, seed)
+    exact_seconds, exact = _time_call(segment_state_results, df, 'Category', 'Customer_Segment', 'Key')
+    exact_counts = df.groupby(['Category', 'Key']).size()
+
+    rows = [{'method': 'exact', 'seconds': exact_seconds, 'recall': 1.0, 'max_error': 0, 'error_bound': 0}]
+    for capacity in capacities:
+        def run():
+            sketches = CategorySketches(capacity)
+            for start in range(0, num_records, chunk_size):
+                chunk = df.iloc[start:start + chunk_size]
+                sketches.update(chunk['Category'], chunk['Key'])
+            return sketches
+        seconds, sketches = _time_call(run)
+
+        found = total = max_error = error_bound = 0
+        for category, result in exact.items():
+            sketch = sketches.sketches[category]
+            top = sketch.top(5)
+            true_top = {state['state'] for state in result['top5_states']}
+            found += len(true_top & {key for key, _, _ in top})
+            total += len(true_top)
+            max_error = max([max_error] + [count - exact_counts[(category, key)] for key, count, _ in top])
+            error_bound = max(error_bound, sketch.total // capacity)
+        rows.append({'method': f"sketch k={capacity}", 'seconds': seconds, 'recall': found / total,
+                     'max_error': int(max_error), 'error_bound': int(error_bound)})
+    return rows
+
+def print_sketch_results(rows):
+    print("{:<16} {:>10} {:>12} {:>12} {:>14}".format("Method", "Seconds", "Top 5 recall", "Max error", "Bound (N/k)"))
+    print("-" * 68)
+    for row in rows:
+        print("{:<16} {:>10.3f} {:>12.2f} {:>12,} {:>14,}".format(
+            row['method'], row['seconds'], row['recall'], row['max_error'], row['error_bound']
+        ))
+
+#Pipeline stages timed by the suite, as (setup, timed statement). Both run in a fresh interpreter per
+#stage with rows, count (rows processed, setup may change it) and the fixture paths already defined
+suite_stages = {
+    'generation': ("import synthetic_data", "synthetic_data.generate_synthetic_data(rows, seed=0)"),
+    'csv_load': ("import pandas as pd", "pd.read_csv(synthetic)"),
+    'calculate_average_discounts': ("import prediction", "prediction.calculate_average_discounts(synthetic, seed=0)"),
+    'analyze_synthetic_data': ("import prediction", "prediction.analyze_synthetic_data(synthetic)"),
+    'state_segment': ("import customer_data_analysis", "customer_data_analysis.state_segment(customers)"),
+    'predict_segment_and_state': (
+        "import numpy as np, prediction\n"
+        "results = prediction.analyze_synthetic_data(synthetic)\n"
+        "names = np.resize(np.array(list(results), dtype=object), min(rows, 100_000))\n"
+        "count = len(names)", #One Python call per row gets too slow to be worth timing past 100k
+        "for name in names: prediction.predict_segment_and_state(name, results)"
+    ),
+    'predict_batch': (
+        "import pandas as pd, prediction\n"
+        "from predictor import compile_predictor\n"
+        "predictor = compile_predictor(prediction.analyze_synthetic_data(synthetic))\n"
+        "categories = pd.read_csv(synthetic, usecols=['Category'], dtype='category')['Category']",
+        "predictor.predict_batch(categories)"
+    ),
+    'find_optimal_discounts': ("import optimal_discount", "optimal_discount.find_optimal_discounts(transactions)"),
+    'prediction_main': ("import prediction\nos.chdir(fixture_dir)", "prediction.main()")
+}
+default_suite_sizes = (1_000, 100_000, 1_000_000, 10_000_000)
+
+def build_fixtures(root, rows, seed=0, chunk_size=1_000_000):
+    #Writes the synthetic, customer and transaction CSVs for one size, reused while rows and seed match
+    fixture_dir = os.path.join(root, str(rows))
+    paths = {
+        'fixture_dir': fixture_dir,
+        'synthetic': os.path.join(fixture_dir, 'synthetic_ecommerce_data.csv'), #The name prediction.main reads
+        'customers': os.path.join(fixture_dir, 'customers.csv'),
+        'transactions': os.path.join(fixture_dir, 'transactions.csv')
+    }
+    marker = os.path.join(fixture_dir, 'fixture.json')
+    if os.path.exists(marker):
+        with open(marker) as handle:
+            if json.load(handle) == {'rows': rows, 'seed': seed}:
+                return paths
+
+    os.makedirs(fixture_dir, exist_ok=True)
+    synthetic_data.write_synthetic_data(paths['synthetic'], rows, chunk_size=chunk_size, seed=seed)
+    customer_columns = {'Category': 'category_name', 'Customer_State': 'customer_state', 'Customer_Segment': 'customer_segment'}
+    synthetic_data.write_chunks((chunk.rename(columns=customer_columns)
+                                 for chunk in pd.read_csv(paths['synthetic'], chunksize=chunk_size)), paths['customers'])
+    synthetic_data.write_transaction_data(paths['transactions'], rows, chunk_size=chunk_size, seed=seed)
+    with open(marker, 'w') as handle:
+        json.dump({'rows': rows, 'seed': seed}, handle)
+    return paths
+
+def run_stage(stage, rows, paths):
+    #Times one stage in a child interpreter and returns its measurements, stage output is discarded
+    setup, statement = suite_stages[stage]
+    script = "\n".join([
+        "import contextlib, io, json, os, resource, time",
+        f"rows = count = {rows}",
+        *(f"{name} = {path!r}" for name, path in paths.items()),
+        "with contextlib.redirect_stdout(io.StringIO()):",
+        f"    exec({setup!r})",
+        "setup_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss",
+        "wall, cpu = time.perf_counter(), time.process_time()",
+        "with contextlib.redirect_stdout(io.StringIO()):",
+        f"    exec({statement!r})",
+        "wall, cpu = time.perf_counter() - wall, time.process_time() - cpu",
+        "print(json.dumps({'count': count, 'seconds': wall, 'cpu_seconds': cpu, 'setup_rss_kb': setup_rss,",
+        "                  'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))"
+    ])
+    output = subprocess.run(
+        [sys.executable, '-c', script], capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    measured = json.loads(output.stdout.splitlines()[-1])
+    return {
+        'stage': stage,
+        'records': rows,
+        'rows_processed': measured['count'],
+        'seconds': measured['seconds'],
+        'cpu_seconds': measured['cpu_seconds'],
+        'rows_per_sec': measured['count'] / measured['seconds'] if measured['seconds'] > 0 else None,
+        'peak_rss_mb': measured['peak_rss_kb'] / 1024,
+        'setup_rss_mb': measured['setup_rss_kb'] / 1024,
+        'stage_memory_mb': (measured['peak_rss_kb'] - measured['setup_rss_kb']) / 1024 #Growth of the peak during the timed call
+    }
+
+def benchmark_suite(sizes=default_suite_sizes, stages=None, fixture_root='.benchmark_fixtures', repeat=1,
+                    warm_cache=False, seed=0):
+    #Runs every stage at every size, keeping the fastest of repeat runs. The dataset cache is removed
+    #before each run so loads are timed cold, unless warm_cache builds it once up front
+    stages = list(stages or suite_stages)
+    results = []
+    for rows in sizes:
+        paths = build_fixtures(fixture_root, rows, seed)
+        for stage in stages:
+            runs = []
+            for _ in range(repeat):
+                shutil.rmtree(os.path.join(paths['fixture_dir'], '.dataset_cache'), ignore_errors=True)
+                if warm_cache:
+                    run_stage('analyze_synthetic_data', rows, paths)
+                    run_stage('find_optimal_discounts', rows, paths)
+                runs.append(run_stage(stage, rows, paths))
+            best = min(runs, key=lambda run: run['seconds'])
+            best['peak_rss_mb'] = max(run['peak_rss_mb'] for run in runs)
+            results.append(best)
+            print(f"{stage:<28} {rows:>12,} rows {best['seconds']:>10.3f}s {best['peak_rss_mb']:>10,.0f} MB", flush=True)
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'repeat': repeat,
+            'warm_cache': warm_cache
+        },
+        'results': results
+    }
+
+def compare_results(baseline, current, time_threshold=0.2, memory_threshold=0.2, min_seconds=0.05):
+    #Pairs up stages by name and size, a stage regressed if it got slower or bigger by more than the threshold
+    #Runs shorter than min_seconds in both files are too noisy to flag on time
+    previous = {(row['stage'], row['records']): row for row in baseline['results']}
+    rows = []
+    for row in current['results']:
+        old = previous.get((row['stage'], row['records']))
+        if old is None:
+            continue
+        time_ratio = row['seconds'] / old['seconds'] if old['seconds'] > 0 else None
+        memory_ratio = row['peak_rss_mb'] / old['peak_rss_mb'] if old['peak_rss_mb'] > 0 else None
+        slower = (time_ratio is not None and time_ratio > 1 + time_threshold
+                  and max(row['seconds'], old['seconds']) >= min_seconds)
+        bigger = memory_ratio is not None and memory_ratio > 1 + memory_threshold
+        rows.append({
+            'stage': row['stage'],
+            'records': row['records'],
+            'baseline_seconds': old['seconds'],
+            'seconds': row['seconds'],
+            'time_ratio': time_ratio,
+            'memory_ratio': memory_ratio,
+            'regression': [kind for kind, flagged in (('time', slower), ('memory', bigger)) if flagged]
+        })
+    return rows
+
+def print_comparison(rows):
+    print("{:<28} {:>12} {:>12} {:>12} {:>8} {:>8}  {}".format(
+        "Stage", "Records", "Baseline s", "Current s", "Time", "Memory", "Regression"))
+    print("-" * 96)
+    for row in rows:
+        print("{:<28} {:>12,} {:>12.3f} {:>12.3f} {:>7.2f}x {:>7.2f}x  {}".format(
+            row['stage'], row['records'], row['baseline_seconds'], row['seconds'],
+            row['time_ratio'] or 0, row['memory_ratio'] or 0, ", ".join(row['regression'])
+        ))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the market analysis pipeline")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generation = commands.add_parser('generation', help="Rows per second of the loop and vectorized generators")
+    generation.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    generation.add_argument('--loop-limit', type=int, default=100_000)
+    generation.add_argument('--seed', type=int, default=0)
+
+    memory = commands.add_parser('memory', help="Peak RSS of bare and typed CSV loading and of a cold and warm cached load")
+    memory.add_argument('data_path')
+    memory.add_argument('--schema', default='synthetic_schema', choices=['synthetic_schema', 'transaction_schema'])
+    memory.add_argument('--columns', nargs='+', default=['Category', 'Customer_Segment', 'Customer_State'])
+
+    sketch = commands.add_parser('sketch', help="Speed and accuracy of approximate top states against exact counts")
+    sketch.add_argument('--records', type=int, default=2_000_000)
+    sketch.add_argument('--keys', type=int, default=100_000, help="Number of distinct keys, like ZIP codes")
+    sketch.add_argument('--capacities', type=int, nargs='+', default=[16, 64, 256])
+    sketch.add_argument('--seed', type=int, default=0)
+
+    suite = commands.add_parser('suite', help="Times every pipeline stage across data sizes and writes JSON")
+    suite.add_argument('--sizes', type=int, nargs='+', default=list(default_suite_sizes))
+    suite.add_argument('--stages', nargs='+', choices=list(suite_stages))
+    suite.add_argument('--fixtures', default='.benchmark_fixtures', help="Directory the generated datasets are kept in")
+    suite.add_argument('--repeat', type=int, default=1, help="Runs per stage, the fastest is kept")
+    suite.add_argument('--warm-cache', action='store_true', help="Time loads against an already built dataset cache")
+    suite.add_argument('--output', default='benchmark_results.json')
+
+    compare = commands.add_parser('compare', help="Flags stages that regressed against a baseline results file")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=0.2, help="Allowed slowdown, 0.2 means 20%%")
+    compare.add_argument('--memory-threshold', type=float, default=0.2)
+
+    args = parser.parse_args()
+    if args.command == 'generation':
+        print_generation_results(benchmark_generation(args.sizes, args.loop_limit, args.seed))
+    elif args.command == 'memory':
+        print_memory_results(benchmark_memory(args.data_path, args.schema, args.columns))
+    elif args.command == 'sketch':
+        print_sketch_results(benchmark_sketch(args.records, args.keys, args.capacities, seed=args.seed))
+    elif args.command == 'suite':
+        report = benchmark_suite(args.sizes, args.stages, args.fixtures, args.repeat, args.warm_cache)
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print(f"Results written to {args.output}")
+    elif args.command == 'compare':
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        with open(args.current) as handle:
+            current = json.load(handle)
+        comparison = compare_results(baseline, current, args.threshold, args.memory_threshold)
+        print_comparison(comparison)
+        regressions = [row for row in comparison if row['regression']]
+        print(f"\n{len(regressions)} regressions out of {len(comparison)} stages")
+        sys.exit(1 if regressions else 0) #Non zero exit lets a CI job fail on a regression
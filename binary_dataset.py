@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from aggregation import count_codes, count_revenue_codes, merge_counts
+from datasets import (ensure_cache, cache_arrays, decode_text,
+                      synthetic_schema, transaction_schema, customer_schema)
+
+#Single file layout: magic, header length (uint64), JSON header, then every column as one packed array
+#Each array starts on an alignment boundary so it can be mapped straight into an np.memmap. Categorical
+#columns are small integer codes, their labels are a fixed width UTF-8 array stored in the file as well
+#Text columns are the byte length of every value followed by all of the values' UTF-8 bytes
+binary_magic = b'MKTBIN\x00\x01'
+binary_version = 1
+alignment = 64
+
+#Rows counted per slice of the mapped arrays, only the temporary keys of one slice are ever allocated
+default_chunk_rows = 1_000_000
+
+def _aligned(position):
+    return -(-position // alignment) * alignment
+
+def is_binary_dataset(path):
+    try:
+        with open(path, 'rb') as handle:
+            return handle.read(len(binary_magic)) == binary_magic
+    except OSError:
+        return False
+
+def _encode_labels(labels):
+    #Fixed width UTF-8 bytes, so the labels can be mapped from the file like any other array
+    encoded = np.array([label.encode('utf-8') for label in labels.tolist()], dtype=bytes)
+    return encoded if encoded.dtype.itemsize > 0 else encoded.astype('S1')
+
+def _write_array(handle, array, block_rows=8_000_000):
+    for start in range(0, len(array), block_rows):
+        handle.write(np.ascontiguousarray(array[start:start + block_rows]).tobytes())
+
+def export_binary(data_path, output_path, schema=None, columns=None):
+    #Writes a CSV (through its columnar cache) as one memory-mappable file, returns the number of rows
+    cache_dir = ensure_cache(data_path, schema=schema, columns=columns)
+    meta, arrays = cache_arrays(cache_dir, columns)
+    arrays = [(name, kind, values, _encode_labels(extra) if kind == 'categorical' else extra)
+              for name, kind, values, extra in arrays]
+
+    #Offsets are relative to the start of the data section, which follows the header
+    entries = []
+    position = 0
+    for name, kind, values, labels in arrays:
+        entry = {'name': name, 'kind': kind, 'dtype': values.dtype.str, 'offset': position}
+        position = _aligned(position + values.nbytes)
+        if kind == 'categorical':
+            entry.update(labels_dtype=labels.dtype.str, num_labels=len(labels), labels_offset=position)
+            position = _aligned(position + labels.nbytes)
+        elif kind == 'text':
+            entry.update(text_bytes=len(labels), text_offset=position)
+            position = _aligned(position + len(labels))
+        entries.append(entry)
+
+    header = json.dumps({
+        'version': binary_version,
+        'rows': meta['rows'],
+        'source': os.path.abspath(data_path),
+        'sha256': meta['sha256'],
+        'schema': meta['schema'],
+        'columns': entries
+    }).encode('utf-8')
+    data_start = _aligned(len(binary_magic) + 8 + len(header))
+
+    #Written to a temporary name and swapped in, processes with the old file mapped keep reading it intact
+    with open(output_path + '.tmp', 'wb') as handle:
+        handle.write(binary_magic)
+        handle.write(np.uint64(len(header)).tobytes())
+        handle.write(header)
+        for entry, (name, kind, values, labels) in zip(entries, arrays):
+            handle.seek(data_start + entry['offset'])
+            _write_array(handle, values)
+            if kind == 'categorical':
+                handle.seek(data_start + entry['labels_offset'])
+                handle.write(labels.tobytes())
+            elif kind == 'text':
+                handle.seek(data_start + entry['text_offset'])
+                _write_array(handle, labels, block_rows=256 * 2 ** 20)
+        handle.truncate(data_start + position)
+    os.replace(output_path + '.tmp', output_path)
+    return meta['rows']
+
+class MappedDataset:
+    #Read only view of a binary dataset, every column is an np.memmap over the file so several
+    #processes opening the same file share one copy of it in the page cache
+    def __init__(self, path):
+        with open(path, 'rb') as handle:
+            if handle.read(len(binary_magic)) != binary_magic:
+                raise ValueError(f"{path} is not a binary dataset")
+            header_length = int(np.frombuffer(handle.read(8), dtype=np.uint64)[0])
+            self.header = json.loads(handle.read(header_length))
+        if self.header['version'] != binary_version:
+            raise ValueError(f"Unsupported binary dataset version: {self.header['version']}")
+
+        self.path = path
+        self.rows = self.header['rows']
+        self.data_start = _aligned(len(binary_magic) + 8 + header_length)
+        self.entries = {entry['name']: entry for entry in self.header['columns']}
+        self.columns = list(self.entries)
+        self._labels = {}
+
+    def _map(self, dtype, offset, length):
+        if length == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self.path, dtype=np.dtype(dtype), mode='r', offset=self.data_start + offset, shape=(length,))
+
+    def _entry(self, name):
+        if name not in self.entries:
+            raise KeyError(f"Column not in dataset: {name}")
+        return self.entries[name]
+
+    def is_categorical(self, name):
+        return self._entry(name)['kind'] == 'categorical'
+
+    def array(self, name):
+        #Codes of a categorical column or the values of any other column, mapped and not copied
+        #Text columns are the exception, their strings are decoded into memory
+        entry = self._entry(name)
+        values = self._map(entry['dtype'], entry['offset'], self.rows)
+        if entry['kind'] == 'text':
+            return decode_text(values, self._map(np.uint8, entry['text_offset'], entry['text_bytes']))
+        return values
+
+    def labels(self, name):
+        #Labels of a categorical column in code order, decoded once and then kept
+        if name not in self._labels:
+            entry = self._entry(name)
+            if entry['kind'] != 'categorical':
+                raise ValueError(f"{name} is not a categorical column")
+            raw = self._map(entry['labels_dtype'], entry['labels_offset'], entry['num_labels'])
+            self._labels[name] = [label.decode('utf-8') for label in raw.tolist()]
+        return self._labels[name]
+
+    def to_frame(self, columns=None):
+        #DataFrame over the mapped arrays, categoricals come back like load_dataset returns them
+        data = {}
+        for name in columns or self.columns:
+            if self.is_categorical(name):
+                data[name] = pd.Categorical.from_codes(self.array(name), categories=self.labels(name), validate=False)
+            else:
+                data[name] = self.array(name)
+        return pd.DataFrame(data, copy=False)
+
+def open_binary(path):
+    return MappedDataset(path)
+
+def _slices(dataset, chunk_rows):
+    #Row ranges to count one after another, an empty file still gets one empty range so tables come out
+    return [(start, min(start + chunk_rows, dataset.rows)) for start in range(0, max(dataset.rows, 1), chunk_rows)]
+
+def _encoded(dataset, name):
+    #Codes and labels for a categorical column, other columns are encoded from their distinct values
+    if dataset.is_categorical(name):
+        return dataset.array(name), dataset.labels(name)
+    values = dataset.array(name)
+    labels, codes = np.unique(values, return_inverse=True)
+    return codes, [label.item() for label in labels]
+
+def count_mapped_segments(dataset, category_col='Category', segment_col='Customer_Segment',
+                          state_col='Customer_State', chunk_rows=default_chunk_rows):
+    #Same count tables as count_segments_states, taken slice by slice straight from the mapped codes
+    columns = [_encoded(dataset, name) for name in (category_col, segment_col, state_col)]
+    counts = None
+    for start, stop in _slices(dataset, chunk_rows):
+        partial = count_codes(*(part for codes, labels in columns for part in (codes[start:stop], labels)))
+        counts = partial if counts is None else merge_counts(counts, partial)
+    return counts
+
+def count_mapped_revenue(dataset, category_col='Category', discount_col='Discount (%)',
+                         revenue_col='Final_Price(Rs.)', chunk_rows=default_chunk_rows):
+    #Same revenue tables as count_revenue, taken slice by slice straight from the mapped arrays
+    category_codes, categories = _encoded(dataset, category_col)
+    discounts = dataset.array(discount_col)
+    revenue = dataset.array(revenue_col)
+    counts = None
+    for start, stop in _slices(dataset, chunk_rows):
+        partial = count_revenue_codes(category_codes[start:stop], categories, discounts[start:stop], revenue[start:stop])
+        counts = partial if counts is None else merge_counts(counts, partial)
+    return counts
+
+if __name__ == "__main__":
+    schemas = {'synthetic': synthetic_schema, 'transaction': transaction_schema, 'customer': customer_schema}
+
+    parser = argparse.ArgumentParser(description="Exports datasets to a memory-mappable binary file and inspects them")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help="Writes a CSV as one binary file")
+    export.add_argument('data_path')
+    export.add_argument('output_path')
+    export.add_argument('--schema', choices=list(schemas), default='synthetic')
+    export.add_argument('--columns', nargs='+', default=None, help="Only export these columns")
+
+    info = commands.add_parser('info', help="Lists the columns of a binary file")
+    info.add_argument('path')
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        rows = export_binary(args.data_path, args.output_path, schemas[args.schema], args.columns)
+        print(f"Wrote {rows} rows to '{args.output_path}' ({os.path.getsize(args.output_path) / 2 ** 20:,.1f} MB)")
+    elif args.command == 'info':
+        dataset = open_binary(args.path)
+        print(f"{dataset.rows} rows from {dataset.header['source']}")
+        for name in dataset.columns:
+            entry = dataset.entries[name]
+            detail = f"{entry['num_labels']} labels" if entry['kind'] == 'categorical' else entry['kind']
+            print(f"  {name}: {np.dtype(entry['dtype'])} ({detail})")
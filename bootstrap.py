@@ -0,0 +1,90 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from aggregation import never_seen
+
+#Replicates are drawn in fixed size batches, each from its own child seed, so the output for a
+#given seed is the same whether the batches run in one process or spread over a pool
+batch_size = 1000
+
+def _batches(replicates, seed):
+    num_batches = max(1, -(-replicates // batch_size))
+    seeds = np.random.SeedSequence(seed).spawn(num_batches)
+    sizes = [min(batch_size, replicates - i * batch_size) for i in range(num_batches)]
+    return list(zip(sizes, seeds))
+
+def _run_batches(function, shared, replicates, seed, workers):
+    tasks = [(shared, size, batch_seed) for size, batch_seed in _batches(replicates, seed)]
+    if workers == 1 or len(tasks) == 1:
+        return [function(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(function, tasks))
+
+def _segment_batch(task):
+    #Resampling a category's rows with replacement is one multinomial draw over its segment counts,
+    #the last column collects rows with no segment so every category keeps its own row total
+    (totals, pvals), size, seed = task
+    rng = np.random.default_rng(seed)
+    return rng.multinomial(totals, pvals, size=(size, len(totals)))[..., :-1]
+
+def bootstrap_segment_intervals(counts, replicates=2000, confidence=0.95, seed=None, workers=1):
+    #Percentile intervals for every segment probability, from a segment count accumulator
+    #Returns {category: {segment: (lower, upper)}}
+    totals = counts['category_totals'].astype(np.int64)
+    segment_counts = counts['segment_counts']
+    safe_totals = np.maximum(totals, 1)[:, None]
+    pvals = np.concatenate([segment_counts / safe_totals, 1 - segment_counts.sum(axis=1, keepdims=True) / safe_totals], axis=1)
+    pvals = np.clip(pvals, 0, 1)
+
+    draws = np.concatenate(_run_batches(_segment_batch, (totals, pvals), replicates, seed, workers))
+    alpha = (1 - confidence) / 2
+    lower, upper = np.quantile(draws / safe_totals, [alpha, 1 - alpha], axis=0)
+
+    intervals = {}
+    for c in np.argsort(counts['category_first'], kind='stable'):
+        if counts['category_first'][c] == never_seen:
+            break
+        intervals[counts['categories'][c]] = {
+            counts['segments'][s]: (float(lower[c, s]), float(upper[c, s]))
+            for s in np.flatnonzero(segment_counts[c] > 0)
+        }
+    return intervals
+
+def _discount_batch(task):
+    #Each replicate redraws how many of a category's orders fall on each discount, then the revenue of
+    #those orders from the pair's mean and spread (a normal draw for the sum of resampled order values)
+    (orders, means, spreads), size, seed = task
+    rng = np.random.default_rng(seed)
+    totals = orders.sum(axis=1)
+    pvals = orders / np.maximum(totals, 1)[:, None]
+    resampled = rng.multinomial(totals, pvals, size=(size, len(totals)))
+    revenue = resampled * means + np.sqrt(resampled) * spreads * rng.standard_normal(resampled.shape)
+
+    #Same rule as optimal_from_revenue, only discounts with orders compete and ties go to the lowest
+    best = np.argmax(np.where(resampled > 0, revenue, -np.inf), axis=-1)
+    num_categories, num_discounts = orders.shape
+    keys = np.arange(num_categories) * num_discounts + best
+    return np.bincount(keys.ravel(), minlength=orders.size).reshape(orders.shape)
+
+def bootstrap_discount_wins(counts, replicates=2000, seed=None, workers=1):
+    #Share of bootstrap replicates in which each discount is the revenue maximizing one, from a revenue accumulator
+    #Returns {category: {discount: probability}} over the discounts the category has orders for
+    orders = counts['orders'].astype(np.int64)
+    safe_orders = np.maximum(orders, 1)
+    means = counts['revenue'] / safe_orders
+    spreads = np.zeros(orders.shape)
+    if 'revenue_squares' in counts: #Accumulators saved before squares were tracked resample order counts only
+        spreads = np.sqrt(np.clip(counts['revenue_squares'] / safe_orders - means ** 2, 0, None))
+
+    wins = sum(_run_batches(_discount_batch, (orders, means, spreads), replicates, seed, workers))
+
+    probabilities = {}
+    for c in np.argsort(counts['category_first'], kind='stable'):
+        if counts['category_first'][c] == never_seen:
+            break
+        if orders[c].any():
+            probabilities[counts['categories'][c]] = {
+                counts['discounts'][d]: wins[c, d] / replicates for d in np.flatnonzero(orders[c] > 0)
+            }
+    return probabilities
@@ -0,0 +1,215 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from aggregation import column_codes, build_results, optimal_from_revenue, money_values, discount_value_codes
+from datasets import load_dataset, synthetic_schema, transaction_schema
+
+#Column each cube dimension is read from, the first one present in the data wins
+dimension_sources = {
+    'Category': ['Category', 'category_name'],
+    'Customer_Segment': ['Customer_Segment', 'customer_segment'],
+    'Customer_State': ['Customer_State', 'customer_state'],
+    'Discount': ['Discount (%)', 'Discount'],
+    'Price_Bucket': ['Price', 'Price (Rs.)'],
+    'Month': ['Purchase_Date']
+}
+revenue_sources = ['Final_Price(Rs.)', 'Price', 'Price (Rs.)']
+
+default_price_edges = [50, 100, 200, 500]
+
+def _price_labels(edges):
+    labels = [f"<{edges[0]}"]
+    labels += [f"{low}-{high}" for low, high in zip(edges[:-1], edges[1:])]
+    labels.append(f">={edges[-1]}")
+    return labels
+
+def _source(df, dimension):
+    for column in dimension_sources[dimension]:
+        if column in df.columns:
+            return column
+    return None
+
+def _dimension_codes(df, dimension, price_edges):
+    #Integer codes and labels for one dimension, -1 marks rows that cannot be placed
+    values = df[_source(df, dimension)]
+    if dimension == 'Discount':
+        codes, labels = discount_value_codes(values.to_numpy())
+        return codes, [label.item() for label in labels]
+    if dimension == 'Price_Bucket':
+        prices = values.to_numpy(np.float64)
+        codes = np.searchsorted(price_edges, prices, side='right')
+        return np.where(np.isnan(prices), -1, codes), _price_labels(price_edges)
+    if dimension == 'Month':
+        codes, periods = pd.factorize(values.dt.to_period('M'), sort=True)
+        return codes.astype(np.int64), [str(period) for period in periods]
+    codes, labels = column_codes(values)
+    order = np.argsort(np.array(labels, dtype=str), kind='stable') #Sorted labels make cubes from different files line up
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return np.where(codes >= 0, rank[codes] if len(rank) else -1, -1), [labels[i] for i in order]
+
+class Cube:
+    #Dense order count and revenue arrays with one axis per dimension, indexed by label codes
+    def __init__(self, dimensions, labels, counts, revenue):
+        self.dimensions = list(dimensions)
+        self.labels = {dimension: list(labels[dimension]) for dimension in self.dimensions}
+        self.counts = counts
+        self.revenue = revenue
+        self._lookup = {dimension: {label: i for i, label in enumerate(self.labels[dimension])}
+                        for dimension in self.dimensions}
+
+    def _index(self, dimension, selection):
+        lookup = self._lookup[dimension]
+        if isinstance(selection, (list, tuple, set)):
+            return [lookup[label] for label in selection]
+        return lookup[selection]
+
+    def slice(self, **selections):
+        #Fixes dimensions to one label (the axis is dropped) or to a list of labels (the axis is kept)
+        unknown = set(selections) - set(self.dimensions)
+        if unknown:
+            raise KeyError(f"Cube has no dimension {sorted(unknown)}")
+
+        counts, revenue = self.counts, self.revenue
+        dimensions = list(self.dimensions)
+        labels = dict(self.labels)
+        #Works from the last axis back so the axis numbers of the ones still to do do not move
+        for axis in reversed(range(len(self.dimensions))):
+            dimension = self.dimensions[axis]
+            if dimension not in selections:
+                continue
+            selected = self._index(dimension, selections[dimension])
+            counts = np.take(counts, selected, axis=axis)
+            revenue = np.take(revenue, selected, axis=axis)
+            if isinstance(selected, list):
+                labels[dimension] = [self.labels[dimension][i] for i in selected]
+            else:
+                dimensions.remove(dimension)
+                del labels[dimension]
+        return Cube(dimensions, labels, counts, revenue)
+
+    def marginalize(self, keep):
+        #Sums out every dimension not in keep, the kept axes stay in the requested order
+        keep = [keep] if isinstance(keep, str) else list(keep)
+        drop = tuple(i for i, dimension in enumerate(self.dimensions) if dimension not in keep)
+        remaining = [dimension for dimension in self.dimensions if dimension in keep]
+        order = [remaining.index(dimension) for dimension in keep]
+        counts = self.counts.sum(axis=drop).transpose(order)
+        revenue = self.revenue.sum(axis=drop).transpose(order)
+        return Cube(keep, {dimension: self.labels[dimension] for dimension in keep}, counts, revenue)
+
+    def value(self, measure='count', **selections):
+        #Total of a measure over every cell matching the selections
+        data = self.slice(**selections)
+        return (data.counts if measure == 'count' else data.revenue).sum()
+
+    def top_k(self, dimension, k=5, measure='count', **selections):
+        #Labels of one dimension with the largest totals, after applying the selections
+        data = self.slice(**selections).marginalize([dimension])
+        values = data.counts if measure == 'count' else data.revenue
+        order = np.argsort(-values, kind='stable')[:k]
+        return [(data.labels[dimension][i], values[i].item()) for i in order]
+
+    def to_series(self, measure='count'):
+        values = self.counts if measure == 'count' else self.revenue
+        index = pd.MultiIndex.from_product([self.labels[d] for d in self.dimensions], names=self.dimensions)
+        return pd.Series(values.ravel(), index=index, name=measure)
+
+    def merge(self, other):
+        #Adds another cube over the same dimensions, labels only the other cube has are appended
+        if other.dimensions != self.dimensions:
+            raise ValueError("Cubes must have the same dimensions to merge")
+        labels = {}
+        for dimension in self.dimensions:
+            known = set(self.labels[dimension])
+            labels[dimension] = self.labels[dimension] + [label for label in other.labels[dimension] if label not in known]
+        counts = np.zeros([len(labels[d]) for d in self.dimensions], dtype=np.int64)
+        revenue = np.zeros(counts.shape)
+        lookup = {d: {label: i for i, label in enumerate(labels[d])} for d in self.dimensions}
+        for cube in (self, other):
+            index = np.ix_(*[[lookup[d][label] for label in cube.labels[d]] for d in self.dimensions])
+            counts[index] += cube.counts
+            revenue[index] += cube.revenue
+        return Cube(self.dimensions, labels, counts, revenue)
+
+    def segment_state_results(self, top_n=5):
+        #Same shape as analyze_synthetic_data, ties are ordered by label instead of first appearance
+        table = self.marginalize(['Category', 'Customer_Segment', 'Customer_State']).counts
+        rank = lambda size: np.broadcast_to(np.arange(size, dtype=np.int64), (table.shape[0], size))
+        counts = {
+            'categories': self.labels['Category'],
+            'segments': self.labels['Customer_Segment'],
+            'states': self.labels['Customer_State'],
+            'category_totals': table.sum(axis=(1, 2)),
+            'category_first': np.where(table.sum(axis=(1, 2)) > 0, np.arange(table.shape[0]), np.iinfo(np.int64).max),
+            'segment_counts': table.sum(axis=2),
+            'segment_first': rank(table.shape[1]),
+            'state_counts': table.sum(axis=1),
+            'state_first': rank(table.shape[2])
+        }
+        return build_results(counts, top_n)
+
+    def optimal_discounts(self):
+        #Same as find_optimal_discounts, categories come out in label order
+        data = self.marginalize(['Category', 'Discount'])
+        counts = {
+            'categories': self.labels['Category'],
+            'discounts': [np.int64(label) if isinstance(label, int) else label for label in self.labels['Discount']],
+            'category_first': np.arange(len(self.labels['Category']), dtype=np.int64),
+            'revenue': data.revenue,
+            'orders': data.counts
+        }
+        return optimal_from_revenue(counts)
+
+    def save(self, path):
+        #One .npz file holds both arrays and the labels
+        meta = json.dumps({'dimensions': self.dimensions, 'labels': self.labels})
+        np.savez_compressed(path, counts=self.counts, revenue=self.revenue, meta=np.array(meta))
+
+def load_cube(path):
+    with np.load(path) as data:
+        meta = json.loads(str(data['meta']))
+        return Cube(meta['dimensions'], meta['labels'], data['counts'], data['revenue'])
+
+def cube_from_frame(df, dimensions=None, price_edges=None):
+    #Scans a frame once into a dense cube over every requested dimension the frame has columns for
+    price_edges = list(price_edges or default_price_edges)
+    if dimensions is None:
+        dimensions = [d for d in ('Category', 'Customer_Segment', 'Customer_State', 'Discount') if _source(df, d)]
+    missing = [d for d in dimensions if _source(df, d) is None]
+    if missing:
+        raise KeyError(f"No column for dimensions {missing}")
+
+    codes = []
+    labels = {}
+    for dimension in dimensions:
+        dimension_codes, labels[dimension] = _dimension_codes(df, dimension, price_edges)
+        codes.append(dimension_codes)
+
+    shape = tuple(len(labels[d]) for d in dimensions)
+    present = np.logical_and.reduce([c >= 0 for c in codes]) if codes else np.ones(len(df), dtype=bool)
+    flat = np.ravel_multi_index([c[present] for c in codes], shape) if codes else np.zeros(present.sum(), dtype=np.int64)
+
+    revenue_column = next((column for column in revenue_sources if column in df.columns), None)
+    weights = money_values(df[revenue_column])[present] if revenue_column else None
+    size = int(np.prod(shape))
+
+    counts = np.bincount(flat, minlength=size).reshape(shape)
+    revenue = np.bincount(flat, weights=weights, minlength=size).reshape(shape) if weights is not None else np.zeros(shape)
+    return Cube(dimensions, labels, counts, revenue)
+
+def build_cube(data_path, dimensions=None, price_edges=None, schema=None):
+    #Loads only the columns the dimensions need through the dataset cache and builds the cube
+    header = pd.read_csv(data_path, nrows=0).columns
+    if schema is None:
+        schema = transaction_schema if 'Final_Price(Rs.)' in header else synthetic_schema
+    if dimensions is None:
+        dimensions = [d for d in ('Category', 'Customer_Segment', 'Customer_State', 'Discount')
+                      if any(column in header for column in dimension_sources[d])]
+
+    columns = [next(column for column in dimension_sources[d] if column in header) for d in dimensions]
+    columns += [column for column in revenue_sources if column in header][:1]
+    df = load_dataset(data_path, columns=list(dict.fromkeys(columns)), schema=schema)
+    return cube_from_frame(df, dimensions, price_edges)
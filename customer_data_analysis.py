@@ -1,40 +1,56 @@
-import pandas as pd
-
-def state_segment(data_path):
-
-    df = pd.read_csv(data_path)#Loads the data set
-
-    print(f"Total records: {len(df)}")
-    print(f"Product categories: {df['category_name'].nunique()}")
-    print(f"Unique customer segments: {df['customer_segment'].unique()}")
-    print(f"Unique customer states: {df['customer_state'].nunique()}") #Gives basic output of loaded data set
-
-    results = {}
-
-    for category in df['category_name'].unique():
-        # Filter data for this category
-        category_data = df[df['category_name'] == category]
-        total_category_records = len(category_data) #Iterates through each category to perform analysis
-
-        segment_counts = category_data['customer_segment'].value_counts() #Counts how many times each unqiue value occurs in segment column
-        segment_probabilities = segment_counts / total_category_records #Coverts the count into probabilities by dividing each count by total number of unqiue values in category
-
-        state_counts = category_data['customer_state'].value_counts().head(5) #Counts occurance of each state in dataset and selects top 5
-        state_percentages = (state_counts / total_category_records * 100).round(2) #Divides count by total records and multiplies by 100 to get percentage chance
-
-        #Stores the results for the category
-        results[category] = {
-            'total_records': total_category_records,
-            'segment_probabilities': segment_probabilities.to_dict(),
-            'top5_states': [
-                {'state': state, 'count': count, 'percentage': f"{percentage}%"}
-                for state, count, percentage in zip(
-                    state_counts.index,
-                    state_counts.values,
-                    state_percentages.values
-                )
-            ]
-        }
+import numpy as np
+
+from datasets import load_dataset, customer_schema
+from aggregation import segment_state_results, stream_segment_state_counts, build_results, never_seen
+from sketches import approximate_segment_state_results
+from instrumentation import stage
+from binary_dataset import is_binary_dataset, open_binary, count_mapped_segments
+
+def state_segment(data_path, chunksize=None, approximate=False, sketch_capacity=64):
+    if approximate:
+        #Top states come from fixed size sketches, each one reports how far its count may be overstated
+        return approximate_segment_state_results(data_path, 'category_name', 'customer_segment', 'customer_state',
+                                                 sketch_capacity, chunksize or 1_000_000, customer_schema)
+
+    if chunksize or is_binary_dataset(data_path):
+        return _state_segment_streaming(data_path, chunksize)
+
+    with stage('load', 'state_segment') as measured:
+        df = load_dataset(data_path, columns=['category_name', 'customer_segment', 'customer_state'],
+                          schema=customer_schema)#Loads the data set
+        measured.rows = len(df)
+
+    with stage('render', 'state_segment', len(df)):
+        print(f"Total records: {len(df)}")
+        print(f"Product categories: {df['category_name'].nunique()}")
+        print(f"Unique customer segments: {df['customer_segment'].dropna().unique().tolist()}")
+        print(f"Unique customer states: {df['customer_state'].nunique()}") #Gives basic output of loaded data set
+
+    #Counts segments and top 5 states for every category in one grouped pass
+    with stage('aggregate', 'state_segment', len(df)):
+        results = segment_state_results(df, 'category_name', 'customer_segment', 'customer_state')
+
+    return results
+
+def _state_segment_streaming(data_path, chunksize):
+    #Same analysis as state_segment, but reads the file in chunks and works from the count tables
+    #Binary datasets are counted straight from their memory-mapped codes instead
+    with stage('aggregate', 'state_segment') as measured:
+        if is_binary_dataset(data_path):
+            counts = count_mapped_segments(open_binary(data_path), 'category_name', 'customer_segment', 'customer_state')
+        else:
+            counts = stream_segment_state_counts(data_path, 'category_name', 'customer_segment', 'customer_state',
+                                                 chunksize, customer_schema)
+        results = build_results(counts)
+        measured.rows = counts['rows']
+
+    segment_first = counts['segment_first'].min(axis=0) #Orders segments by where they first appear, like unique()
+    state_totals = counts['state_counts'].sum(axis=0)
+
+    print(f"Total records: {counts['rows']}")
+    print(f"Product categories: {len(results)}")
+    print(f"Unique customer segments: {[counts['segments'][s] for s in np.argsort(segment_first, kind='stable') if segment_first[s] != never_seen]}")
+    print(f"Unique customer states: {int((state_totals > 0).sum())}")
 
     return results
 
@@ -64,17 +80,20 @@ if __name__ == "__main__":
     data_path = '2nddataset.csv'
     results = state_segment(data_path)
 
-    #Displays the results
-    print("\nCustomer Segment Probabilities by Category")
-    for category, data in results.items():
-        print(f"\n{category} (Total: {data['total_records']} records)")
-        print("Segment Distribution:")
-        for segment, probability in data['segment_probabilities'].items():
-            print(f"  - {segment}: {probability:.4f} ({probability*100:.2f}%)")
-
-    print("\nTop 5 Customer States by Category ")
-    for category, data in results.items():
-        print(f"\n{category}")
-        print("Top States:")
-        for i, state_data in enumerate(data['top5_states'], 1):
-            print(f"  {i}. {state_data['state']}: {state_data['count']} orders ({state_data['percentage']})")
\ No newline at end of file
+    with stage('render', 'customer_data_analysis.main', len(results)):
+        #Displays the results
+        print("\nCustomer Segment Probabilities by Category")
+        for category, data in results.items():
+            print(f"\n{category} (Total: {data['total_records']} records)")
+            print("Segment Distribution:")
+            for segment, probability in data['segment_probabilities'].items():
+                print(f"  - {segment}: {probability:.4f} ({probability*100:.2f}%)")
+
+        print("\nTop 5 Customer States by Category ")
+        for category, data in results.items():
+            print(f"\n{category}")
+            print("Top States:")
+            for i, state_data in enumerate(data['top5_states'], 1):
+                #Approximate results carry an error bar, the true share can be up to that much lower
+                error_bar = f" -{state_data['percentage_error']}%" if 'percentage_error' in state_data else ""
+                print(f"  {i}. {state_data['state']}: {state_data['count']} orders ({state_data['percentage']}{error_bar})")
\ No newline at end of file
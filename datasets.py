@@ -0,0 +1,428 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+#Bumped whenever the cache layout changes so old caches get rebuilt instead of misread
+cache_version = 3
+
+#Column types per dataset. Low cardinality strings are categories, prices and discounts are
+#downcast and dates are parsed once. Columns not listed keep whatever read_csv infers
+synthetic_schema = {
+    'Customer_ID': 'str',
+    'Product_Name': 'category',
+    'Category': 'category',
+    'Customer_State': 'category',
+    'Customer_Segment': 'category',
+    'Price': 'float32'
+}
+
+transaction_schema = {
+    'User_ID': 'str',
+    'Product_ID': 'str',
+    'Category': 'category',
+    'Price (Rs.)': 'float32',
+    'Discount (%)': 'float32', #float so a blank discount reads as NaN, whole percentages still come out as int64 labels
+    'Final_Price(Rs.)': 'float32',
+    'Payment_Method': 'category',
+    'Purchase_Date': 'date'
+}
+
+#Only the columns customer_data_analysis uses are known for the customer dataset
+customer_schema = {
+    'category_name': 'category',
+    'customer_segment': 'category',
+    'customer_state': 'category'
+}
+
+date_format = '%d-%m-%Y' #Purchase_Date is written as DD-MM-YYYY
+
+def _parse_dates(df, dates):
+    #Dates that do not match date_format become NaT instead of leaving the whole column as strings
+    for name in dates:
+        if name in df.columns:
+            df[name] = pd.to_datetime(df[name], format=date_format, errors='coerce')
+    return df
+
+def read_csv_typed(data_path, schema=None, columns=None, chunksize=None, **read_options):
+    #pd.read_csv with the schema applied, only the requested columns are parsed at all
+    #Any extra keyword arguments are passed straight through to pd.read_csv
+    schema = schema or {}
+    wanted = (lambda name: name in columns) if columns is not None else (lambda name: True)
+
+    dtype = {name: kind for name, kind in schema.items() if kind != 'date' and wanted(name)}
+    dates = [name for name, kind in schema.items() if kind == 'date' and wanted(name)]
+
+    reader = pd.read_csv(
+        data_path,
+        usecols=columns,
+        dtype=dtype or None,
+        chunksize=chunksize,
+        **read_options
+    )
+    if not dates:
+        return reader
+    if chunksize is None:
+        return _parse_dates(reader, dates)
+    return (_parse_dates(chunk, dates) for chunk in reader)
+
+def default_cache_dir(data_path):
+    #Caches live next to the data file so every script that reads it shares them
+    data_path = os.path.abspath(data_path)
+    return os.path.join(os.path.dirname(data_path), '.dataset_cache', os.path.basename(data_path))
+
+def file_hash(path, block_size=16 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _source_stamp(data_path):
+    stat = os.stat(data_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def _read_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'meta.json')) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+def _write_meta(cache_dir, meta):
+    #Written to a temporary name first so a reader never sees a half written file
+    path = os.path.join(cache_dir, 'meta.json')
+    with open(path + '.tmp', 'w') as handle:
+        json.dump(meta, handle)
+    os.replace(path + '.tmp', path)
+
+def cache_is_fresh(data_path, cache_dir, schema=None):
+    #A cache is reused while the source keeps its size and mtime. If only the mtime moved
+    #(a touch or a copy) the content hash decides, and a match refreshes the stored stamp
+    meta = _read_meta(cache_dir)
+    if meta is None or meta.get('version') != cache_version or meta.get('schema') != (schema or {}):
+        return False
+
+    stamp = _source_stamp(data_path)
+    if stamp['size'] != meta['size']:
+        return False
+    if stamp['mtime_ns'] == meta['mtime_ns']:
+        return True
+
+    if file_hash(data_path) != meta['sha256']:
+        return False
+    meta.update(stamp)
+    _write_meta(cache_dir, meta)
+    return True
+
+#Rows converted per block when a column file is rewritten, keeps those passes at a fixed memory cost
+block_rows = 4_000_000
+
+def _column_stem(name):
+    #File name stem of a column, taken from its name so columns added to a cache later never clash
+    return hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+
+def _column_files(column):
+    stem = column['stem']
+    if column['kind'] == 'values':
+        return [f"{stem}.values"]
+    if column['kind'] == 'text':
+        return [f"{stem}.lengths", f"{stem}.text"]
+    return [f"{stem}.codes", f"{stem}.labels.npy"]
+
+def _map_raw(path, dtype):
+    #Column files are raw arrays, an empty one cannot be mapped so it becomes an empty array
+    dtype = np.dtype(dtype)
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+class _ValuesColumn:
+    #Numbers and dates, every chunk is appended to the column file as it arrives
+    kind = 'values'
+
+    def __init__(self, stem):
+        self.path = stem + '.values'
+        self.handle = open(self.path, 'wb')
+        self.dtype = None
+
+    def add(self, values):
+        if values.dtype == object or pd.api.types.is_string_dtype(values.dtype):
+            values = pd.to_numeric(values)
+        array = values.to_numpy()
+        if self.dtype is None:
+            self.dtype = array.dtype
+        elif array.dtype != self.dtype:
+            self._promote(np.result_type(self.dtype, array.dtype))
+        self.handle.write(np.ascontiguousarray(array, dtype=self.dtype).tobytes())
+
+    def _promote(self, dtype):
+        #A later chunk needed a wider type (an integer column with missing values), what is written so far is converted
+        self.handle.close()
+        os.replace(self.path, self.path + '.old')
+        written = _map_raw(self.path + '.old', self.dtype)
+        with open(self.path, 'wb') as handle:
+            for start in range(0, len(written), block_rows):
+                handle.write(written[start:start + block_rows].astype(dtype).tobytes())
+        del written
+        os.remove(self.path + '.old')
+        self.handle = open(self.path, 'ab')
+        self.dtype = dtype
+
+    def close(self):
+        self.handle.close()
+
+    def finish(self):
+        self.close()
+        return {'dtype': (self.dtype or np.dtype(np.float64)).str}
+
+class _CategoricalColumn:
+    #Codes are written chunk by chunk against one growing dictionary of labels, then renumbered in label order
+    kind = 'categorical'
+
+    def __init__(self, stem):
+        self.stem = stem
+        self.lookup = {}
+        self.handle = open(stem + '.raw', 'wb')
+
+    def add(self, values):
+        if not (pd.api.types.is_string_dtype(values.dtype) or values.dtype == object):
+            values = values.map(str, na_action='ignore') #A chunk that happened to parse as numbers
+        codes, uniques = pd.factorize(values)
+        uniques = np.asarray(uniques, dtype=object) #Plain objects iterate much faster than a pandas string array
+        lookup = self.lookup
+        mapping = np.array([lookup.setdefault(label, len(lookup)) for label in uniques], dtype=np.int32)
+        self.handle.write(np.where(codes >= 0, mapping[codes] if len(mapping) else -1, -1).astype(np.int32).tobytes())
+
+    def close(self):
+        self.handle.close()
+
+    def finish(self):
+        #Sorts the labels so categorical columns group and sort like the plain strings they replace
+        self.close()
+        labels = np.array(list(self.lookup), dtype=object)
+        order = np.argsort(labels.astype(str), kind='stable')
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        dtype = np.int8 if len(labels) < 2 ** 7 else np.int16 if len(labels) < 2 ** 15 else np.int32
+
+        raw = _map_raw(self.stem + '.raw', np.int32)
+        with open(self.stem + '.codes', 'wb') as handle:
+            for start in range(0, len(raw), block_rows):
+                codes = raw[start:start + block_rows]
+                handle.write(np.where(codes >= 0, rank[codes] if len(rank) else -1, -1).astype(dtype).tobytes())
+        del raw
+        os.remove(self.stem + '.raw')
+        np.save(self.stem + '.labels.npy', labels[order].astype(str))
+        return {'dtype': np.dtype(dtype).str}
+
+class _TextColumn:
+    #'str' columns such as IDs are nearly all distinct, so a dictionary of them would only cost memory
+    #Each value is stored as its UTF-8 bytes plus its byte length, -1 marks a missing value
+    kind = 'text'
+
+    def __init__(self, stem):
+        self.lengths = open(stem + '.lengths', 'wb')
+        self.text = open(stem + '.text', 'wb')
+
+    def add(self, values):
+        missing = values.isna().to_numpy()
+        encoded = [str(value).encode('utf-8') for value in values.to_numpy()[~missing]]
+        lengths = np.full(len(values), -1, dtype=np.int64)
+        lengths[~missing] = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        self.lengths.write(lengths.tobytes())
+        self.text.write(b''.join(encoded))
+
+    def close(self):
+        self.lengths.close()
+        self.text.close()
+
+    def finish(self):
+        self.close()
+        return {'dtype': np.dtype(np.int64).str}
+
+def decode_text(lengths, text):
+    #Strings of a text column from its byte lengths and UTF-8 bytes, missing values come back as NaN
+    lengths = np.asarray(lengths)
+    sizes = np.maximum(lengths, 0)
+    ends = np.cumsum(sizes)
+    starts = ends - sizes
+    text = bytes(text)
+    values = np.array([text[start:end].decode('utf-8') for start, end in zip(starts.tolist(), ends.tolist())], dtype=object)
+    values[lengths < 0] = np.nan
+    return values
+
+def _is_values_column(values, kind):
+    #Numbers and dates are stored as they are, everything else becomes a categorical or text
+    if kind in ('category', 'str'):
+        return False
+    if kind is not None:
+        return True
+    dtype = values.dtype
+    numeric = pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_datetime64_any_dtype(dtype)
+    return numeric and not values.isna().all()
+
+def _column_writer(name, values, schema, build_dir):
+    kind = schema.get(name)
+    writer = _TextColumn if kind == 'str' else _ValuesColumn if _is_values_column(values, kind) else _CategoricalColumn
+    return writer(os.path.join(build_dir, _column_stem(name)))
+
+def _header(data_path):
+    return list(pd.read_csv(data_path, nrows=0).columns)
+
+def _write_columns(data_path, build_dir, schema, columns, chunksize):
+    #Parses only the given columns, each chunk goes straight into the column files so memory stays
+    #at about one chunk however large the file is. Returns the row count and the column entries
+    writers = None
+    rows = 0
+    try:
+        for chunk in read_csv_typed(data_path, schema, columns, chunksize):
+            if writers is None:
+                writers = {name: _column_writer(name, chunk[name], schema, build_dir) for name in chunk.columns}
+            for name, writer in writers.items():
+                writer.add(chunk[name])
+            rows += len(chunk)
+
+        if writers is None: #Only a header, or an empty file
+            empty = pd.Series([], dtype=object)
+            writers = {name: _column_writer(name, empty, schema, build_dir)
+                       for name in _header(data_path) if columns is None or name in columns}
+
+        entries = [{'name': name, 'kind': writer.kind, 'stem': _column_stem(name), **writer.finish()}
+                   for name, writer in writers.items()]
+    finally:
+        for writer in (writers or {}).values():
+            writer.close()
+    return rows, entries
+
+def _build_dir(cache_dir):
+    parent = os.path.dirname(cache_dir)
+    os.makedirs(parent, exist_ok=True)
+    build_dir = tempfile.mkdtemp(dir=parent, prefix='.building-')
+    os.chmod(build_dir, 0o755) #mkdtemp is private by default, other users' jobs read the cache too
+    return build_dir
+
+def build_cache(data_path, cache_dir=None, schema=None, columns=None, chunksize=1_000_000):
+    #Parses the CSV once in chunks and writes one file per column, every column or only the given ones
+    #String columns become integer codes plus a sorted label array, 'str' columns are kept as text
+    #and typed columns are stored in their schema dtype
+    cache_dir = cache_dir or default_cache_dir(data_path)
+    stamp = _source_stamp(data_path)
+    schema = schema or {}
+    header = _header(data_path)
+    if columns is not None:
+        columns = [name for name in header if name in columns] #Unknown columns are reported by read_cache
+
+    build_dir = _build_dir(cache_dir)
+    try:
+        rows, entries = _write_columns(data_path, build_dir, schema, columns, chunksize)
+        _write_meta(build_dir, {
+            'version': cache_version,
+            'source': os.path.abspath(data_path),
+            'size': stamp['size'],
+            'mtime_ns': stamp['mtime_ns'],
+            'sha256': file_hash(data_path),
+            'rows': rows,
+            'schema': schema,
+            'header': header,
+            'columns': entries
+        })
+
+        #Swaps the finished cache in, an older cache for the same file is replaced
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.rename(build_dir, cache_dir)
+    except BaseException:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+
+    return cache_dir
+
+def _extend_cache(data_path, cache_dir, schema, columns, meta, chunksize):
+    #Adds columns to a cache that is still fresh, files land before the metadata lists them so
+    #readers only ever see complete columns
+    build_dir = _build_dir(cache_dir)
+    try:
+        rows, entries = _write_columns(data_path, build_dir, schema or {}, columns, chunksize)
+        for entry in entries:
+            for file_name in _column_files(entry):
+                os.replace(os.path.join(build_dir, file_name), os.path.join(cache_dir, file_name))
+        added = {entry['name'] for entry in entries}
+        meta['columns'] = [column for column in meta['columns'] if column['name'] not in added] + entries
+        _write_meta(cache_dir, meta)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+def ensure_cache(data_path, cache_dir=None, schema=None, columns=None, chunksize=1_000_000):
+    #Makes sure the cache holds the given columns (every column when None). A stale cache is rebuilt
+    #with just those columns, a fresh one only gets the columns it is missing parsed and added
+    cache_dir = cache_dir or default_cache_dir(data_path)
+    if not cache_is_fresh(data_path, cache_dir, schema):
+        return build_cache(data_path, cache_dir, schema, columns, chunksize)
+
+    meta = _read_meta(cache_dir)
+    cached = {column['name'] for column in meta['columns']}
+    missing = [name for name in meta['header'] if name not in cached and (columns is None or name in columns)]
+    if missing:
+        _extend_cache(data_path, cache_dir, schema, missing, meta, chunksize)
+    return cache_dir
+
+def _read_column(cache_dir, column):
+    #One cached column, read into memory, string columns come back as categoricals
+    path = os.path.join(cache_dir, column['stem'])
+    if column['kind'] == 'values':
+        return np.fromfile(path + '.values', dtype=np.dtype(column['dtype']))
+    if column['kind'] == 'text':
+        return decode_text(np.fromfile(path + '.lengths', dtype=np.int64), np.fromfile(path + '.text', dtype=np.uint8))
+    codes = np.fromfile(path + '.codes', dtype=np.dtype(column['dtype']))
+    labels = np.load(path + '.labels.npy')
+    return pd.Categorical.from_codes(codes, categories=labels, validate=False)
+
+def _selected(meta, columns):
+    #Cached columns in the requested order (file order when columns is None)
+    by_name = {column['name']: column for column in meta['columns']}
+    if columns is None:
+        return [by_name[name] for name in meta['header'] if name in by_name]
+    missing = [name for name in columns if name not in by_name]
+    if missing:
+        raise KeyError(f"Columns not in dataset: {missing}")
+    return [by_name[name] for name in columns]
+
+def read_cache(cache_dir, columns=None):
+    #Loads the cached columns back into a DataFrame
+    meta = _read_meta(cache_dir)
+    data = {column['name']: _read_column(cache_dir, column) for column in _selected(meta, columns)}
+    return pd.DataFrame(data, copy=False)
+
+def cache_arrays(cache_dir, columns=None):
+    #The cached columns as arrays mapped from disk, nothing is read until it is used
+    #Returns the cache metadata and (name, kind, values, extra) for each column. extra is the label
+    #array of a categorical's codes, the UTF-8 bytes of a text column's lengths and None otherwise
+    meta = _read_meta(cache_dir)
+    arrays = []
+    for column in _selected(meta, columns):
+        path = os.path.join(cache_dir, column['stem'])
+        if column['kind'] == 'values':
+            arrays.append((column['name'], 'values', _map_raw(path + '.values', column['dtype']), None))
+        elif column['kind'] == 'text':
+            arrays.append((column['name'], 'text', _map_raw(path + '.lengths', np.int64), _map_raw(path + '.text', np.uint8)))
+        else:
+            arrays.append((column['name'], 'categorical', _map_raw(path + '.codes', column['dtype']),
+                           np.load(path + '.labels.npy')))
+    return meta, arrays
+
+def load_dataset(data_path, columns=None, schema=None, cache_dir=None, use_cache=True):
+    #Reads a CSV through the columnar cache, only the requested columns are ever parsed into it
+    if not use_cache:
+        return read_csv_typed(data_path, schema, columns)
+
+    try:
+        cache_dir = ensure_cache(data_path, cache_dir, schema, columns)
+    except OSError:
+        #The cache could not be written (a read only export mount), the file is read directly instead
+        return read_csv_typed(data_path, schema, columns)
+    return read_cache(cache_dir, columns)
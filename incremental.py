@@ -0,0 +1,149 @@
+import csv
+import hashlib
+import io
+import json
+import os
+
+from aggregation import (count_segments_states, count_revenue, merge_counts, build_results,
+                         optimal_from_revenue, counts_to_dict, counts_from_dict)
+from datasets import read_csv_typed, default_cache_dir
+
+#How much of the already consumed file is re-hashed on every refresh to notice a rewritten file
+fingerprint_bytes = 64 * 1024
+
+def default_state_path(data_path):
+    return default_cache_dir(data_path) + '.state.json'
+
+def _fingerprint(handle, end):
+    #Hash of the bytes just before the watermark, if they change the file was rewritten not appended to
+    start = max(0, end - fingerprint_bytes)
+    handle.seek(start)
+    return hashlib.sha256(handle.read(end - start)).hexdigest()
+
+def new_state(data_path):
+    return {
+        'source': os.path.abspath(data_path),
+        'header': None,
+        'byte_offset': 0,
+        'rows': 0,
+        'fingerprint': None,
+        'segment_counts': None,
+        'revenue': None
+    }
+
+def load_state(state_path):
+    with open(state_path) as handle:
+        data = json.load(handle)
+    for key in ('segment_counts', 'revenue'):
+        if data[key] is not None:
+            data[key] = counts_from_dict(data[key])
+    return data
+
+def save_state(state, state_path):
+    #Written to a temporary name and swapped in so a crash never leaves a half written state
+    data = dict(state)
+    for key in ('segment_counts', 'revenue'):
+        if data[key] is not None:
+            data[key] = counts_to_dict(data[key])
+    os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+    with open(state_path + '.tmp', 'w') as handle:
+        json.dump(data, handle)
+    os.replace(state_path + '.tmp', state_path)
+
+def _read_blocks(handle, end, block_size):
+    #Yields byte blocks that each end on a line break, up to the end position
+    remainder = b''
+    while handle.tell() < end:
+        block = remainder + handle.read(min(block_size, end - handle.tell()))
+        cut = block.rfind(b'\n') + 1
+        if cut == 0:
+            remainder = block
+            continue
+        remainder = block[cut:]
+        yield block[:cut]
+
+def _last_line_end(handle, size):
+    #Position just after the last line break, anything after it is a row still being written
+    position = size
+    while position > 0:
+        start = max(0, position - 64 * 1024)
+        handle.seek(start)
+        block = handle.read(position - start)
+        newline = block.rfind(b'\n')
+        if newline >= 0:
+            return start + newline + 1
+        position = start
+    return 0
+
+def _absorb(state, frame, columns):
+    #Counts the new rows and merges them after everything already in the state
+    segment_cols = columns['segments']
+    if segment_cols is not None:
+        delta = count_segments_states(frame, *segment_cols)
+        state['segment_counts'] = delta if state['segment_counts'] is None else merge_counts(state['segment_counts'], delta)
+
+    revenue_cols = columns['revenue']
+    if revenue_cols is not None:
+        delta = count_revenue(frame, *revenue_cols)
+        state['revenue'] = delta if state['revenue'] is None else merge_counts(state['revenue'], delta)
+
+    state['rows'] += len(frame)
+
+def refresh(data_path, state_path=None, category_col='Category', segment_col='Customer_Segment',
+            state_col='Customer_State', discount_col='Discount (%)', revenue_col='Final_Price(Rs.)',
+            schema=None, block_size=64 * 1024 * 1024):
+    #Brings the persisted analysis state up to date with rows appended since the last call
+    #Only bytes past the watermark are parsed. A file that shrank, changed its header or
+    #changed before the watermark is treated as rewritten and counted again from the start
+    state_path = state_path or default_state_path(data_path)
+    state = load_state(state_path) if os.path.exists(state_path) else new_state(data_path)
+
+    size = os.path.getsize(data_path)
+    with open(data_path, 'rb') as handle:
+        header = handle.readline()
+        header_end = handle.tell()
+        header_text = header.decode('utf-8').rstrip('\r\n')
+
+        rewritten = (
+            state['header'] not in (None, header_text)
+            or size < state['byte_offset']
+            or (state['byte_offset'] > 0 and _fingerprint(handle, state['byte_offset']) != state['fingerprint'])
+        )
+        if rewritten:
+            state = new_state(data_path)
+
+        names = next(csv.reader([header_text])) if header_text else []
+        columns = {
+            'segments': (category_col, segment_col, state_col)
+            if {category_col, segment_col, state_col} <= set(names) else None,
+            'revenue': (category_col, discount_col, revenue_col)
+            if {category_col, discount_col, revenue_col} <= set(names) else None
+        }
+        wanted = sorted({name for group in columns.values() if group for name in group}, key=names.index)
+
+        end = _last_line_end(handle, size)
+        start = max(state['byte_offset'], header_end)
+        if end > start:
+            handle.seek(start)
+            for block in _read_blocks(handle, end, block_size):
+                frame = read_csv_typed(io.BytesIO(block), schema, wanted, header=None, names=names)
+                _absorb(state, frame, columns)
+
+        state['header'] = header_text
+        state['byte_offset'] = max(end, header_end)
+        state['fingerprint'] = _fingerprint(handle, state['byte_offset'])
+
+    save_state(state, state_path)
+    return state
+
+def state_results(state, top_n=5):
+    #Segment probabilities and top states, same shape as analyze_synthetic_data
+    if state['segment_counts'] is None:
+        return {}
+    return build_results(state['segment_counts'], top_n)
+
+def state_optimal_discounts(state):
+    #Revenue maximizing discount per category, same as find_optimal_discounts
+    if state['revenue'] is None:
+        return {}
+    return optimal_from_revenue(state['revenue'])
@@ -0,0 +1,186 @@
+import atexit
+import cProfile
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+#Opt-in timing of pipeline stages (load, impute, aggregate, predict, render). Nothing is measured until
+#enable() is called or MARKET_ANALYSIS_INSTRUMENT is set, either to a JSON lines path or to "summary"
+#MARKET_ANALYSIS_PROFILE=<dir> adds a cProfile dump per stage, MARKET_ANALYSIS_TRACEMALLOC=1 Python allocation peaks
+_settings = {
+    'enabled': False,
+    'output': None,
+    'profile_dir': None,
+    'trace_memory': False
+}
+records = []
+_profiling = [False] #Only one profiler can run at a time, nested stages are timed but not profiled
+
+def _rss_mb():
+    #Current resident set size, falls back to the peak where /proc is not available and to None on
+    #platforms with neither
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        return _peak_rss_mb()
+
+def _peak_rss_mb():
+    try:
+        import resource #Unix only, imported here so the pipeline still imports on Windows
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024 #Bytes on macOS, KB on Linux
+
+def enable(output=None, profile_dir=None, trace_memory=False):
+    #output is a path or open stream that gets one JSON line per stage, None keeps records in memory only
+    if isinstance(output, str):
+        output = open(output, 'a')
+    _settings.update(enabled=True, output=output, profile_dir=profile_dir, trace_memory=trace_memory)
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    output = _settings['output']
+    if output is not None and output not in (sys.stdout, sys.stderr):
+        output.close()
+    if _settings['trace_memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _settings.update(enabled=False, output=None, profile_dir=None, trace_memory=False)
+
+def is_enabled():
+    return _settings['enabled']
+
+class _DisabledStage:
+    #Shared do nothing stage handed out while instrumentation is off, so a disabled stage costs one call
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_disabled_stage = _DisabledStage()
+
+class Stage:
+    #Measures one run of a stage, set rows inside the block once the number of rows handled is known
+    def __init__(self, name, where=None, rows=None):
+        self.name = name
+        self.where = where
+        self.rows = rows
+        self.profile = None
+
+    def __enter__(self):
+        if _settings['profile_dir'] and not _profiling[0]:
+            self.profile = cProfile.Profile()
+            _profiling[0] = True
+        if _settings['trace_memory']:
+            tracemalloc.reset_peak()
+            self.traced_start = tracemalloc.get_traced_memory()[0]
+        self.rss_start = _rss_mb()
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+        if self.profile is not None:
+            self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.profile is not None:
+            self.profile.disable()
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.process_time() - self.cpu_start
+        rss = _rss_mb()
+
+        record = {
+            'stage': self.name,
+            'where': self.where,
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'rows': self.rows,
+            'rows_per_sec': self.rows / wall if self.rows is not None and wall > 0 else None,
+            'rss_delta_mb': rss - self.rss_start if rss is not None and self.rss_start is not None else None,
+            'peak_rss_mb': _peak_rss_mb(),
+            'failed': exc_type is not None
+        }
+        if _settings['trace_memory']:
+            current, peak = tracemalloc.get_traced_memory()
+            record['python_delta_mb'] = (current - self.traced_start) / 2 ** 20
+            record['python_peak_mb'] = (peak - self.traced_start) / 2 ** 20
+        if self.profile is not None:
+            _profiling[0] = False
+            path = os.path.join(_settings['profile_dir'], f"{self.where or 'stage'}.{self.name}.{len(records)}.prof")
+            self.profile.dump_stats(path)
+            record['profile'] = path #Open with python -m pstats
+
+        records.append(record)
+        output = _settings['output']
+        if output is not None:
+            output.write(json.dumps(record) + '\n')
+            output.flush()
+        return False
+
+def stage(name, where=None, rows=None):
+    #with stage('load', where='analyze_synthetic_data') as s: df = ...; s.rows = len(df)
+    if not _settings['enabled']:
+        return _disabled_stage
+    return Stage(name, where, rows)
+
+def instrumented(name, where=None, rows=None):
+    #Decorator form of stage, rows is an optional function of the return value that counts rows
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _settings['enabled']:
+                return function(*args, **kwargs)
+            with Stage(name, where or function.__name__) as measured:
+                result = function(*args, **kwargs)
+                if rows is not None:
+                    measured.rows = rows(result)
+            return result
+        return wrapper
+    return decorate
+
+def summary():
+    #Totals per (where, stage) across every recorded run, in first run order
+    totals = {}
+    for record in records:
+        key = (record['where'], record['stage'])
+        total = totals.setdefault(key, {'where': record['where'], 'stage': record['stage'], 'calls': 0,
+                                        'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows': 0, 'rss_delta_mb': 0.0})
+        total['calls'] += 1
+        total['wall_seconds'] += record['wall_seconds']
+        total['cpu_seconds'] += record['cpu_seconds']
+        total['rows'] += record['rows'] or 0
+        total['rss_delta_mb'] += record['rss_delta_mb'] or 0
+    for total in totals.values():
+        total['rows_per_sec'] = total['rows'] / total['wall_seconds'] if total['rows'] and total['wall_seconds'] > 0 else None
+    return list(totals.values())
+
+def print_summary(stream=None):
+    stream = stream or sys.stderr #Keeps the table apart from the report printed on stdout
+    print("{:<30} {:<10} {:>6} {:>10} {:>10} {:>12} {:>14} {:>10}".format(
+        "Where", "Stage", "Calls", "Wall s", "CPU s", "Rows", "Rows/s", "RSS MB"), file=stream)
+    print("-" * 110, file=stream)
+    for total in summary():
+        rate = f"{total['rows_per_sec']:,.0f}" if total['rows_per_sec'] else "-"
+        print("{:<30} {:<10} {:>6} {:>10.4f} {:>10.4f} {:>12,} {:>14} {:>10.1f}".format(
+            total['where'] or '-', total['stage'], total['calls'], total['wall_seconds'], total['cpu_seconds'],
+            total['rows'], rate, total['rss_delta_mb']), file=stream)
+
+def _enable_from_environment():
+    target = os.environ.get('MARKET_ANALYSIS_INSTRUMENT')
+    if not target:
+        return
+    enable(None if target == 'summary' else target, os.environ.get('MARKET_ANALYSIS_PROFILE') or None,
+           os.environ.get('MARKET_ANALYSIS_TRACEMALLOC') == '1')
+    if target == 'summary':
+        atexit.register(print_summary)
+
+_enable_from_environment()
@@ -0,0 +1,105 @@
+import argparse
+import glob
+from concurrent.futures import ProcessPoolExecutor
+
+from aggregation import count_segments_states, count_revenue, merge_counts, build_results, optimal_from_revenue
+from datasets import read_csv_typed, synthetic_schema, customer_schema, transaction_schema
+from binary_dataset import is_binary_dataset, open_binary, count_mapped_segments, count_mapped_revenue
+
+#Columns and schema each analysis reads, keyed by the name passed to the workers
+analyses = {
+    'segments': (('Category', 'Customer_Segment', 'Customer_State'), synthetic_schema),
+    'customer_segments': (('category_name', 'customer_segment', 'customer_state'), customer_schema),
+    'discounts': (('Category', 'Discount (%)', 'Final_Price(Rs.)'), transaction_schema)
+}
+
+def expand_paths(paths):
+    #Expands a glob or a list of paths and globs, each pattern's matches are sorted so day and region exports keep their order
+    if isinstance(paths, str):
+        paths = [paths]
+    expanded = []
+    for path in paths:
+        matches = sorted(glob.glob(path))
+        expanded.extend(matches if matches else [path]) #A path that matches nothing is kept so it gets reported as failed
+    return list(dict.fromkeys(expanded))
+
+def _count_file(task):
+    #Runs inside a worker process, returns the file's count table or the error instead of raising
+    analysis, path = task
+    columns, schema = analyses[analysis]
+    try:
+        if is_binary_dataset(path): #Workers mapping the same binary file share its pages
+            dataset = open_binary(path)
+            if analysis == 'discounts':
+                return path, count_mapped_revenue(dataset, *columns), None
+            return path, count_mapped_segments(dataset, *columns), None
+        #A one shot batch reads each file directly, a dataset cache per export would only cost memory and disk
+        df = read_csv_typed(path, schema, list(columns))
+        if analysis == 'discounts':
+            return path, count_revenue(df, *columns), None
+        return path, count_segments_states(df, *columns), None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+def _outcomes(tasks, workers):
+    #Results come back in submission order whichever worker finishes first, so merges stay in file order
+    if workers == 1 or len(tasks) <= 1:
+        yield from map(_count_file, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_count_file, tasks)
+
+def count_files(paths, analysis='segments', workers=None):
+    #Counts every file in a process pool and merges the tables in file order, which gives the same
+    #tables as counting the files concatenated. Returns the merged counts (None if every file failed)
+    #and a {path: error} dict for the files that were skipped
+    if analysis not in analyses:
+        raise ValueError(f"Unknown analysis: {analysis}")
+    tasks = [(analysis, path) for path in expand_paths(paths)]
+
+    counts = None
+    failures = {}
+    for path, partial, error in _outcomes(tasks, workers):
+        if error is not None:
+            failures[path] = error
+            continue
+        counts = partial if counts is None else merge_counts(counts, partial)
+    return counts, failures
+
+def analyze_files(paths, workers=None, customer_columns=False, top_n=5):
+    #Segment probabilities and top states across many files, same shape as analyze_synthetic_data
+    #customer_columns=True reads the lower case columns of the state_segment dataset instead
+    counts, failures = count_files(paths, 'customer_segments' if customer_columns else 'segments', workers)
+    return (build_results(counts, top_n) if counts is not None else {}), failures
+
+def find_optimal_discounts_files(paths, workers=None):
+    #Revenue maximizing discount per category across many files, same as find_optimal_discounts
+    counts, failures = count_files(paths, 'discounts', workers)
+    return (optimal_from_revenue(counts) if counts is not None else {}), failures
+
+def print_failures(failures):
+    for path, error in failures.items():
+        print(f"Skipped {path}: {error}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the segment or discount analysis over many files in parallel")
+    parser.add_argument('analysis', choices=list(analyses))
+    parser.add_argument('paths', nargs='+', help="Files or glob patterns, quote globs so they reach this script")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes, defaults to the number of CPUs")
+    args = parser.parse_args()
+
+    if args.analysis == 'discounts':
+        optimal_discounts, failures = find_optimal_discounts_files(args.paths, args.workers)
+        print("Optimal Discount Percentages by Category:")
+        for category, discount in optimal_discounts.items():
+            print(f"{category}: {discount}%")
+    else:
+        results, failures = analyze_files(args.paths, args.workers, args.analysis == 'customer_segments')
+        for category, data in results.items():
+            print(f"\n{category} (Total: {data['total_records']} records)")
+            for segment, probability in data['segment_probabilities'].items():
+                print(f"  - {segment}: {probability:.4f} ({probability*100:.2f}%)")
+            print("  Top States: " + ", ".join(f"{state['state']} ({state['percentage']})" for state in data['top5_states']))
+
+    print_failures(failures)
+    print(f"\n{len(expand_paths(args.paths)) - len(failures)} files analyzed, {len(failures)} failed")
@@ -1,25 +1,123 @@
-import pandas as pd
+import argparse
 
-def find_optimal_discounts(data_path):
-    df = pd.read_csv(data_path)
+import numpy as np
+import pandas as pd
 
-    #Groups everything by category and discount percentage
-    revenue_by_category_discount = df.groupby(['Category', 'Discount (%)'])['Final_Price(Rs.)'].sum().reset_index()
+from datasets import load_dataset, transaction_schema
+from aggregation import count_revenue, optimal_from_revenue, stream_revenue_counts, column_codes, money_values, discount_value_codes
+from incremental import refresh, state_optimal_discounts
+from bootstrap import bootstrap_discount_wins
+from instrumentation import stage
+from binary_dataset import is_binary_dataset, open_binary, count_mapped_revenue
 
-    optimal_discounts = {} #Used to store the best discount rates for each category
+def find_optimal_discounts(data_path, chunksize=None, state_path=None):
+    if state_path:
+        #Only rows appended since the last run are read, the rest comes from the saved revenue table
+        return state_optimal_discounts(refresh(data_path, state_path, schema=transaction_schema))
 
-    #Done for each product category
-    for category in df['Category'].unique():
-        #Filters to only include the rows for the current category
-        category_data = revenue_by_category_discount[revenue_by_category_discount['Category'] == category]
+    if is_binary_dataset(data_path):
+        #Counts straight over the memory-mapped columns, nothing is parsed or copied into a DataFrame
+        with stage('aggregate', 'find_optimal_discounts') as measured:
+            revenue_by_category_discount = count_mapped_revenue(open_binary(data_path), 'Category', 'Discount (%)',
+                                                                'Final_Price(Rs.)')
+            measured.rows = revenue_by_category_discount['rows']
+    elif chunksize:
+        #Streams the file, only the revenue per category and discount is kept in memory
+        with stage('aggregate', 'find_optimal_discounts') as measured:
+            revenue_by_category_discount = stream_revenue_counts(data_path, 'Category', 'Discount (%)', 'Final_Price(Rs.)', chunksize,
+                                                                 transaction_schema)
+            measured.rows = revenue_by_category_discount['rows']
+    else:
+        with stage('load', 'find_optimal_discounts') as measured:
+            df = load_dataset(data_path, columns=['Category', 'Discount (%)', 'Final_Price(Rs.)'], schema=transaction_schema)
+            measured.rows = len(df)
 
-        max_revenue_idx = category_data['Final_Price(Rs.)'].idxmax() #Finds the row with the highest revenue using idmax()
-        optimal_discount = category_data.loc[max_revenue_idx, 'Discount (%)'] #This tells us which discount percent had the best revenue, and extracts it
+        #Groups everything by category and discount percentage
+        with stage('aggregate', 'find_optimal_discounts', len(df)):
+            revenue_by_category_discount = count_revenue(df, 'Category', 'Discount (%)', 'Final_Price(Rs.)')
 
-        optimal_discounts[category] = optimal_discount #Stores the results
+    #For each product category this tells us which discount percent had the best revenue
+    with stage('predict', 'find_optimal_discounts', len(revenue_by_category_discount['categories'])):
+        optimal_discounts = optimal_from_revenue(revenue_by_category_discount)
 
     return optimal_discounts
 
+def optimal_discount_confidence(data_path, replicates=2000, seed=None, workers=1):
+    #How sure the optimal discount choice is, as the share of bootstrap replicates each discount wins
+    df = load_dataset(data_path, columns=['Category', 'Discount (%)', 'Final_Price(Rs.)'], schema=transaction_schema)
+    revenue_by_category_discount = count_revenue(df, 'Category', 'Discount (%)', 'Final_Price(Rs.)')
+
+    optimal_discounts = optimal_from_revenue(revenue_by_category_discount)
+    win_probabilities = bootstrap_discount_wins(revenue_by_category_discount, replicates, seed, workers)
+    return {
+        category: {
+            'optimal_discount': discount,
+            'win_probability': win_probabilities[category][discount],
+            'win_probabilities': win_probabilities[category]
+        }
+        for category, discount in optimal_discounts.items()
+    }
+
+def _load_dated(data_path):
+    df = load_dataset(data_path, columns=['Category', 'Discount (%)', 'Final_Price(Rs.)', 'Purchase_Date'],
+                      schema=transaction_schema)
+    return df.dropna(subset=['Category', 'Discount (%)', 'Purchase_Date'])
+
+def _revenue_tensor(df, period_codes, num_periods):
+    #Revenue and order counts indexed by (period, category, discount), built with one bincount each
+    category_codes, categories = column_codes(df['Category'])
+    discount_codes, discounts = discount_value_codes(df['Discount (%)'].to_numpy())
+
+    shape = (num_periods, len(categories), len(discounts))
+    keys = (period_codes * shape[1] + category_codes) * shape[2] + discount_codes
+    revenue_values = money_values(df['Final_Price(Rs.)'])
+    size = int(np.prod(shape))
+
+    revenue = np.bincount(keys, weights=revenue_values, minlength=size).reshape(shape)
+    orders = np.bincount(keys, minlength=size).reshape(shape)
+    return categories, discounts, revenue, orders
+
+def _best_discounts(revenue, orders, discounts):
+    #Revenue maximizing discount along the last axis, NaN where a category had no orders at all
+    best = np.argmax(np.where(orders > 0, revenue, -np.inf), axis=-1)
+    return np.where(orders.any(axis=-1), discounts[best], np.nan)
+
+def optimal_discounts_by_period(data_path, freq='M'):
+    #Optimal discount per category for every calendar period (freq='M' months, 'W' weeks, 'Q' quarters)
+    #One grouped pass builds the period x category x discount revenue table, then every period is an argmax
+    df = _load_dated(data_path)
+    periods = df['Purchase_Date'].dt.to_period(freq)
+    period_codes, period_index = pd.factorize(periods, sort=True)
+
+    categories, discounts, revenue, orders = _revenue_tensor(df, period_codes, len(period_index))
+    return pd.DataFrame(_best_discounts(revenue, orders, discounts), index=pd.PeriodIndex(period_index, name='Period'),
+                        columns=pd.Index(categories, name='Category'))
+
+def rolling_optimal_discounts(data_path, window_days=30):
+    #Optimal discount per category over a rolling window of window_days ending on each day
+    #Revenue is bucketed by day once, a cumulative sum over the days then gives every window's
+    #totals as a difference of two rows instead of rescanning the orders for each window
+    if window_days < 1:
+        raise ValueError(f"window_days must be at least 1, got {window_days}")
+    df = _load_dated(data_path)
+    days = df['Purchase_Date'].dt.normalize()
+    first_day = days.min()
+    day_codes = ((days - first_day) // pd.Timedelta(days=1)).to_numpy(np.int64)
+    num_days = int(day_codes.max()) + 1 if len(day_codes) else 0
+
+    categories, discounts, revenue, orders = _revenue_tensor(df, day_codes, num_days)
+
+    cumulative_revenue = np.cumsum(revenue, axis=0)
+    cumulative_orders = np.cumsum(orders, axis=0)
+    window_revenue = cumulative_revenue.copy()
+    window_orders = cumulative_orders.copy()
+    window_revenue[window_days:] -= cumulative_revenue[:-window_days]
+    window_orders[window_days:] -= cumulative_orders[:-window_days]
+
+    index = pd.date_range(first_day, periods=num_days, freq='D', name='Window_End') if num_days else pd.DatetimeIndex([], name='Window_End')
+    return pd.DataFrame(_best_discounts(window_revenue, window_orders, discounts), index=index,
+                        columns=pd.Index(categories, name='Category'))
+
 def predict_optimal_discount(category, optimal_discounts):
     if category in optimal_discounts:
         return optimal_discounts[category] #If category is the same, it returns its optimal value
@@ -27,11 +125,35 @@ def predict_optimal_discount(category, optimal_discounts):
         return sum(optimal_discounts.values()) / len(optimal_discounts) #If category doesnt exist, it calculates the average of all the known discounts so we have a reasonable default
 
 if __name__ == "__main__":
-    data_path = '4thdataset.csv'
+    parser = argparse.ArgumentParser(description="Finds the revenue maximizing discount for each category")
+    parser.add_argument('data_path', nargs='?', default='4thdataset.csv')
+    parser.add_argument('--by', choices=['month', 'week', 'quarter'], help="Optimal discount per calendar period")
+    parser.add_argument('--rolling', type=int, metavar='DAYS', help="Optimal discount over a rolling window of DAYS")
+    parser.add_argument('--bootstrap', type=int, metavar='N', help="Also report how often each optimal discount wins over N resamples")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=1, help="Processes to spread the bootstrap replicates over")
+    args = parser.parse_args()
 
-    #Find the optimal discounts for each category
-    optimal_discounts = find_optimal_discounts(data_path)
+    if args.bootstrap:
+        confidence = optimal_discount_confidence(args.data_path, args.bootstrap, args.seed, args.workers)
+        print(f"Optimal Discount Percentages by Category ({args.bootstrap} bootstrap replicates):")
+        for category, data in confidence.items():
+            runners_up = sorted(data['win_probabilities'].items(), key=lambda item: -item[1])[1:3]
+            others = ", ".join(f"{discount}%: {probability:.1%}" for discount, probability in runners_up)
+            print(f"{category}: {data['optimal_discount']}% (wins {data['win_probability']:.1%}, next {others})")
+    elif args.by:
+        drift = optimal_discounts_by_period(args.data_path, {'month': 'M', 'week': 'W', 'quarter': 'Q'}[args.by])
+        print(f"Optimal Discount Percentages by {args.by.capitalize()}:")
+        print(drift.to_string())
+    elif args.rolling is not None:
+        drift = rolling_optimal_discounts(args.data_path, args.rolling)
+        print(f"Optimal Discount Percentages over a rolling {args.rolling} day window:")
+        print(drift.to_string())
+    else:
+        #Find the optimal discounts for each category
+        optimal_discounts = find_optimal_discounts(args.data_path)
 
-    print("Optimal Discount Percentages by Category:")
-    for category, discount in optimal_discounts.items():
-        print(f"{category}: {discount}%") #Displays the results
\ No newline at end of file
+        with stage('render', 'optimal_discount.main', len(optimal_discounts)):
+            print("Optimal Discount Percentages by Category:")
+            for category, discount in optimal_discounts.items():
+                print(f"{category}: {discount}%") #Displays the results
\ No newline at end of file
@@ -1,94 +1,123 @@
 import pandas as pd
+import numpy as np
+
+from datasets import load_dataset, synthetic_schema
+from aggregation import count_segments_states, stream_segment_state_counts, build_results
+from incremental import refresh
+from bootstrap import bootstrap_segment_intervals
+from sketches import approximate_segment_state_results
+from instrumentation import stage
+from binary_dataset import is_binary_dataset, open_binary, count_mapped_segments
+
+#Business logic for categories used to predict discount percentage, each value is equally likely
+discount_distributions = {
+    #Already have low margins, rarely see high discounts
+    "Books": [0, 0, 0, 5, 5, 10, 15, 20],
+    "Office Supplies": [0, 0, 0, 5, 5, 10, 15, 20],
+    #High branded tech doesnt commonly see large discounts
+    "Electronics": [0, 0, 0, 0, 5, 5, 10, 15],
+    "Technology": [0, 0, 0, 0, 5, 5, 10, 15],
+    #Clothing and Sports items have seasonal sales to get rid of old supply
+    "Clothing": [5, 10, 15, 15, 20, 20, 25, 30],
+    "Sports": [5, 10, 15, 15, 20, 20, 25, 30],
+    #Beauty products are well known to have higehr discounts commonly
+    "Beauty": [0, 5, 5, 10, 10, 15, 20, 25],
+    #Home items are frequently on sale
+    "Home & Kitchen": [0, 5, 10, 10, 15, 20, 25, 30],
+    "Furniture": [0, 5, 10, 10, 15, 20, 25, 30],
+    #Depends on quality of toy, but can have no discount to high discount
+    "Toys": [0, 0, 5, 10, 15, 20, 25, 50]
+}
+default_discount_values = [0, 5, 10, 15, 20, 25, 30, 50] #Used for any category not listed above
 
-def calculate_average_discounts(data_path='synthetic_ecommerce_data.csv'):
-    try:
-        df = pd.read_csv(data_path)
-
-        if 'Discount' not in df.columns:
-            import numpy as np
-
-            #Uses business logic for categories to predict discount percentage
-            discounts = []
-            for _, row in df.iterrows():
-                category = row['Category']
-
-                if category in ["Books", "Office Supplies"]:
-                    #Already have low margins, rarely see high discounts
-                    discount_values = [0, 0, 0, 5, 5, 10, 15, 20]
-                    discount = np.random.choice(discount_values)
-
-                elif category in ["Electronics", "Technology"]:
-                    #High branded tech doesnt commonly see large discounts
-                    discount_values = [0, 0, 0, 0, 5, 5, 10, 15]
-                    discount = np.random.choice(discount_values)
-
-                elif category in ["Clothing", "Sports"]:
-                    #Clothing and Sports items have seasonal sales to get rid of old supply
-                    discount_values = [5, 10, 15, 15, 20, 20, 25, 30]
-                    discount = np.random.choice(discount_values)
-
-                elif category in ["Beauty"]:
-                    #Beauty products are well known to have higehr discounts commonly
-                    discount_values = [0, 5, 5, 10, 10, 15, 20, 25]
-                    discount = np.random.choice(discount_values)
+def impute_discounts(categories, seed=None, distributions=None):
+    #Samples a discount for every row from its category's distribution in a single vectorized draw
+    distributions = discount_distributions if distributions is None else distributions
+    rng = np.random.default_rng(seed)
 
-                elif category in ["Home & Kitchen", "Furniture"]:
-                    #Home items are frequently on sale
-                    discount_values = [0, 5, 10, 10, 15, 20, 25, 30]
-                    discount = np.random.choice(discount_values)
+    codes, uniques = pd.factorize(pd.Series(categories), use_na_sentinel=False)
+    value_lists = [distributions.get(category, default_discount_values) for category in uniques]
 
-                elif category in ["Toys"]:
-                    #Depends on quality of toy, but can have no discount to high discount
-                    discount_values = [0, 0, 5, 10, 15, 20, 25, 50]
-                    discount = np.random.choice(discount_values)
+    #Pads the lists into one table so a row's draw is just a random column index below its list length
+    width = max((len(values) for values in value_lists), default=1)
+    table = np.zeros((len(value_lists), width), dtype=np.int64)
+    lengths = np.empty(len(value_lists), dtype=np.int64)
+    for i, values in enumerate(value_lists):
+        table[i, :len(values)] = values
+        lengths[i] = len(values)
 
-                else:
-                    discount_values = [0, 5, 10, 15, 20, 25, 30, 50]
-                    discount = np.random.choice(discount_values)
+    picks = rng.integers(0, lengths[codes])
+    return table[codes, picks]
 
-                discounts.append(discount)
+def calculate_average_discounts(data_path='synthetic_ecommerce_data.csv', seed=None):
+    try:
+        with stage('load', 'calculate_average_discounts') as measured:
+            #Only the columns averaged here are loaded, the synthetic file may or may not carry discounts
+            columns = [name for name in ('Category', 'Discount') if name in pd.read_csv(data_path, nrows=0).columns]
+            df = load_dataset(data_path, columns=columns, schema=synthetic_schema)
+            measured.rows = len(df)
 
-            df['Discount'] = discounts
+        if 'Discount' not in df.columns:
+            with stage('impute', 'calculate_average_discounts', len(df)):
+                df['Discount'] = impute_discounts(df['Category'], seed=seed)
 
         #Group by Category and calculate the average discount
-        avg_discounts = df.groupby('Category')['Discount'].mean().round(1)
+        with stage('aggregate', 'calculate_average_discounts', len(df)):
+            avg_discounts = df.groupby('Category', observed=True)['Discount'].mean().round(1)
 
         return avg_discounts.to_dict()
     except Exception as e:
         print(f"Error calculating average discounts: {e}")
         return {}
 
-def analyze_synthetic_data(data_path='synthetic_ecommerce_data.csv'):
-    df = pd.read_csv(data_path)
-
-    results = {}
-
-    #For each category
-    for category in df['Category'].unique():
-        category_data = df[df['Category'] == category]
-        total_category_records = len(category_data) #Isolates the data for just that category
-
-        segment_counts = category_data['Customer_Segment'].value_counts()
-        segment_probabilities = segment_counts / total_category_records #Calculates the probability distribution of customer segments
-        #Takes the number of entires and divides it by total based off number of orders from each segment
-        #Uses probability distribution
-
-        state_counts = category_data['Customer_State'].value_counts().head(5) #Gets the top 5 states based off order volume
-        state_percentages = (state_counts / total_category_records * 100).round(2) #Done similarly to before, divides each states count by the category records
-        #Converts it to percentage
-
-        results[category] = {
-            'total_records': total_category_records,
-            'segment_probabilities': segment_probabilities.to_dict(),
-            'top5_states': [
-                {'state': state, 'count': count, 'percentage': f"{percentage}%"}
-                for state, count, percentage in zip(
-                    state_counts.index,
-                    state_counts.values,
-                    state_percentages.values
-                )
-            ]
-        } #Stores our results in a consisten format
+def analyze_synthetic_data(data_path='synthetic_ecommerce_data.csv', chunksize=None, state_path=None,
+                           approximate=False, sketch_capacity=64, bootstrap=0, seed=None, workers=1):
+    #bootstrap=N adds 'segment_intervals', 95% intervals for each segment probability from N replicates
+    #workers spreads those replicates over a process pool, the intervals are the same for any number of workers
+    if approximate and bootstrap:
+        raise ValueError("bootstrap intervals need exact counts and cannot be combined with approximate=True")
+    if approximate:
+        #Segments stay exact, top states come from fixed size sketches and carry an error bar
+        return approximate_segment_state_results(data_path, 'Category', 'Customer_Segment', 'Customer_State',
+                                                 sketch_capacity, chunksize or 1_000_000, synthetic_schema)
+
+    df = dataset = None
+    if is_binary_dataset(data_path):
+        #Binary datasets are only mapped, counting reads the codes straight from the page cache
+        with stage('load', 'analyze_synthetic_data') as measured:
+            dataset = open_binary(data_path)
+            measured.rows = dataset.rows
+    elif not state_path and not chunksize:
+        with stage('load', 'analyze_synthetic_data') as measured:
+            df = load_dataset(data_path, columns=['Category', 'Customer_Segment', 'Customer_State'], schema=synthetic_schema)
+            measured.rows = len(df)
+
+    #The streaming and saved state paths read and count in one go, so their reading is part of this stage
+    with stage('aggregate', 'analyze_synthetic_data') as measured:
+        if dataset is not None:
+            counts = count_mapped_segments(dataset, 'Category', 'Customer_Segment', 'Customer_State')
+        elif state_path:
+            #Only rows appended since the last run are read, the rest comes from the saved count tables
+            counts = refresh(data_path, state_path, schema=synthetic_schema)['segment_counts']
+        elif chunksize:
+            #Streams the file through mergeable count tables so memory is bounded by the chunk size
+            counts = stream_segment_state_counts(data_path, 'Category', 'Customer_Segment', 'Customer_State', chunksize,
+                                                 synthetic_schema)
+        else:
+            #Counts segments and top 5 states for every category in one grouped pass
+            counts = count_segments_states(df, 'Category', 'Customer_Segment', 'Customer_State')
+
+        if counts is None:
+            return {}
+
+        #Probabilities are each segment's share of the category's orders, states are ranked by order volume
+        results = build_results(counts)
+        measured.rows = counts['rows']
+
+    if bootstrap:
+        intervals = bootstrap_segment_intervals(counts, bootstrap, seed=seed, workers=workers)
+        for category, result in results.items():
+            result['segment_intervals'] = intervals[category]
 
     return results
 
@@ -176,17 +205,23 @@ def main():
 
     customer_analysis = analyze_synthetic_data(synthetic_data_path)
 
+    with stage('predict', 'prediction.main', len(customer_analysis)):
+        predictions = {category: predict_segment_and_state(category, customer_analysis)
+                       for category in sorted(customer_analysis.keys())}
+
+    with stage('render', 'prediction.main', len(predictions)):
+        render_predictions(predictions, avg_discounts)
+
+def render_predictions(predictions, avg_discounts):
     print("\nPredictions for Each Product Category")
     print("{:<20} {:<50} {:<50} {:<15}".format(
         "Category", "Segment % (Consumer, Corporate, Home Office)", "Top 5 States", "Optimal Discount"
     ))
     print("-" * 135)
 
-    for category in sorted(customer_analysis.keys()):
+    for category, prediction in predictions.items():
         discount = avg_discounts.get(category, 18.5)  #Gives us our average discount %
 
-        prediction = predict_segment_and_state(category, customer_analysis)
-
         consumer_pct = prediction['segment_probabilities'].get('Consumer', 0) * 100
         corporate_pct = prediction['segment_probabilities'].get('Corporate', 0) * 100
         home_office_pct = prediction['segment_probabilities'].get('Home Office', 0) * 100
@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+from prediction import analyze_synthetic_data
+from optimal_discount import find_optimal_discounts
+from predictor import compile_predictor
+from datasets import default_cache_dir
+
+def _stamp(path):
+    #Size and mtime of a file and of its cache metadata, any change means the snapshot is stale
+    stamp = []
+    for candidate in (path, os.path.join(default_cache_dir(path), 'meta.json')):
+        try:
+            stat = os.stat(candidate)
+            stamp.append((stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            stamp.append(None)
+    return stamp
+
+def _source_stamps(data_path, transactions_path):
+    return [_stamp(data_path), _stamp(transactions_path) if transactions_path else None]
+
+def build_snapshot(data_path, transactions_path=None):
+    #Everything a request needs, computed once, requests never touch the data files
+    before = _source_stamps(data_path, transactions_path)
+    results = analyze_synthetic_data(data_path)
+    optimal_discounts = find_optimal_discounts(transactions_path) if transactions_path else {}
+
+    #Loading may (re)write the caches, so the stamps are taken afterwards. If a source file itself
+    #changed while loading, the older stamps are kept so the next poll loads it again
+    after = _source_stamps(data_path, transactions_path)
+    stamps = after if [stamp[0] for stamp in after if stamp] == [stamp[0] for stamp in before if stamp] else before
+    return {
+        'predictor': compile_predictor(results, optimal_discounts),
+        'stamps': stamps,
+        'loaded_at': time.time()
+    }
+
+class LatencyStats:
+    #Keeps the most recent request durations per endpoint, appends to a deque are thread safe
+    def __init__(self, window=10000):
+        self.window = window
+        self.samples = {}
+        self.counts = {}
+
+    def record(self, endpoint, seconds):
+        self.samples.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+        self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def summary(self):
+        summary = {}
+        for endpoint, samples in list(self.samples.items()):
+            values = np.array(samples) * 1000
+            summary[endpoint] = {
+                'requests': self.counts[endpoint],
+                'p50_ms': round(float(np.percentile(values, 50)), 4),
+                'p99_ms': round(float(np.percentile(values, 99)), 4)
+            }
+        return summary
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Not JSON serializable: {type(value).__name__}")
+
+def _batch_records(frame):
+    #Converts predict_batch output to plain JSON values, missing answers become null
+    records = []
+    for category, segment, state, discount in zip(frame['category'], frame['best_segment'],
+                                                   frame['best_state'], frame['optimal_discount']):
+        records.append({
+            'category': category,
+            'best_segment': None if segment != segment else segment, #NaN is the only value not equal to itself
+            'best_state': None if state != state else state,
+            'optimal_discount': None if discount != discount else float(discount)
+        })
+    return records
+
+def _batch_request(body):
+    #Accepts {"categories": [...], "prices": [...]} or a list of {"category": ..., "price": ...}
+    if isinstance(body, dict):
+        return body.get('categories', []), body.get('prices')
+    categories = [item.get('category') for item in body]
+    prices = [item.get('price') for item in body]
+    if all(price is None for price in prices):
+        return categories, None
+    return categories, [np.nan if price is None else price for price in prices]
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' #Keeps connections open between requests
+    disable_nagle_algorithm = True #Headers and body go out as separate writes, Nagle would hold the body back
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, default=_json_default).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        start = time.perf_counter()
+        #Each request keeps the snapshot it started with even if a reload swaps in a new one meanwhile
+        snapshot = self.server.snapshot
+        url = urlparse(self.path)
+        endpoint = url.path.rstrip('/') or '/'
+
+        try:
+            if method == 'GET':
+                status, payload = self._get(endpoint, parse_qs(url.query), snapshot)
+            else:
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'null')
+                status, payload = self._post(endpoint, body, snapshot)
+        except (ValueError, TypeError, AttributeError) as e:
+            status, payload = 400, {'error': str(e)}
+
+        self._send(status, payload)
+        self.server.latency.record(f"{method} {endpoint}", time.perf_counter() - start)
+
+    def _get(self, endpoint, query, snapshot):
+        predictor = snapshot['predictor']
+        category = query.get('category', [None])[0]
+        price = query.get('price', [None])[0]
+
+        if endpoint == '/segment':
+            if category is None:
+                return 400, {'error': 'category is required'}
+            return 200, predictor.predict(category, float(price) if price is not None else None)
+        if endpoint == '/discount':
+            if category is None:
+                return 400, {'error': 'category is required'}
+            discount = predictor.predict_optimal_discount(category)
+            return 200, {'category': category, 'optimal_discount': None if discount != discount else float(discount)}
+        if endpoint == '/metrics':
+            return 200, {
+                'latency': self.server.latency.summary(),
+                'snapshot_loaded_at': snapshot['loaded_at'],
+                'reloads': self.server.reloads
+            }
+        if endpoint == '/health':
+            return 200, {'status': 'ok'}
+        return 404, {'error': f"Unknown endpoint: {endpoint}"}
+
+    def _post(self, endpoint, body, snapshot):
+        if endpoint not in ('/segment', '/discount', '/predict'):
+            return 404, {'error': f"Unknown endpoint: {endpoint}"}
+
+        categories, prices = _batch_request(body)
+        records = _batch_records(snapshot['predictor'].predict_batch(categories, prices))
+        if endpoint == '/segment':
+            records = [{key: record[key] for key in ('category', 'best_segment', 'best_state')} for record in records]
+        elif endpoint == '/discount':
+            records = [{key: record[key] for key in ('category', 'optimal_discount')} for record in records]
+        return 200, {'predictions': records}
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+class PredictionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, data_path, transactions_path=None, poll_interval=2.0, verbose=False):
+        self.data_path = data_path
+        self.transactions_path = transactions_path
+        self.poll_interval = poll_interval
+        self.verbose = verbose
+        self.latency = LatencyStats()
+        self.reloads = 0
+        self.snapshot = build_snapshot(data_path, transactions_path)
+        self._stop = threading.Event()
+        super().__init__(address, PredictionHandler)
+
+    def reload_if_changed(self):
+        #Builds the new snapshot off to the side and swaps it in with a single assignment
+        if _source_stamps(self.data_path, self.transactions_path) == self.snapshot['stamps']:
+            return False
+        try:
+            snapshot = build_snapshot(self.data_path, self.transactions_path)
+        except Exception as e:
+            print(f"Keeping previous snapshot, reload failed: {e}")
+            return False
+        self.snapshot = snapshot
+        self.reloads += 1
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            self.reload_if_changed()
+
+    def serve_forever(self, poll_interval=0.5):
+        watcher = threading.Thread(target=self._watch, daemon=True)
+        watcher.start()
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            self._stop.set()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves segment, state and discount recommendations over HTTP")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--data', default='synthetic_ecommerce_data.csv')
+    parser.add_argument('--transactions', default='4thdataset.csv')
+    parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds between checks for changed data")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = PredictionServer((args.host, args.port), args.data, args.transactions or None,
+                              args.poll_interval, args.verbose)
+    print(f"Serving predictions on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+import prediction
+import customer_data_analysis
+
+#Price buckets for the price based segment rule, a price above 200 lands in the second bucket
+price_edges = [200]
+
+class CompiledPredictor:
+    #Answers for every known category are worked out once up front, so a prediction is a table lookup
+    #rules='business' uses the overrides in prediction.predict_segment_and_state, rules='max' the plain
+    #highest probability pick from customer_data_analysis.predict_segment_and_state
+    def __init__(self, results, optimal_discounts=None, rules='business'):
+        if rules not in ('business', 'max'):
+            raise ValueError(f"Unknown rules: {rules}")
+        self.rules = rules
+        self.categories = list(results)
+        self.category_index = pd.Index(self.categories)
+
+        #Every table gets one extra last row for unknown categories, so a lookup code of -1 lands on it
+        num_rows = len(self.categories) + 1
+        num_buckets = len(price_edges) + 1 if rules == 'business' else 1
+        self.segment_table = np.full((num_rows, num_buckets), None, dtype=object)
+        self.state_table = np.full(num_rows, None, dtype=object)
+        self.predictions = {}
+
+        for i, category in enumerate(self.categories):
+            for bucket in range(num_buckets):
+                #A representative price inside each bucket, None for the lowest one like a call without a price
+                price = None if bucket == 0 else price_edges[bucket - 1] + 1
+                answer = self._reference_predict(category, results, price)
+                self.segment_table[i, bucket] = answer['best_segment']
+                if bucket == 0:
+                    self.state_table[i] = answer['best_state']
+                    self.predictions[category] = answer
+
+        #Discounts come from the transaction data, whose categories need not match the results, so they get their own index
+        optimal_discounts = optimal_discounts or {}
+        self.discount_index = pd.Index(list(optimal_discounts))
+        self.discount_table = np.full(len(optimal_discounts) + 1, np.nan)
+        if optimal_discounts:
+            self.discount_table[:-1] = list(optimal_discounts.values())
+            #Unknown categories get the average of all known discounts, same as predict_optimal_discount
+            self.discount_table[-1] = sum(optimal_discounts.values()) / len(optimal_discounts)
+        self.optimal_discounts = dict(optimal_discounts)
+
+        self.segment_codes, self.segment_labels = self._labels(self.segment_table)
+        self.state_codes, self.state_labels = self._labels(self.state_table)
+
+    def _reference_predict(self, category, results, price):
+        if self.rules == 'max':
+            return customer_data_analysis.predict_segment_and_state(category, results)
+        return prediction.predict_segment_and_state(category, results, price)
+
+    def codes(self, categories, index=None):
+        #Row in the lookup tables for each category, -1 (the unknown row) for categories never seen
+        #index defaults to the segment and state tables, pass discount_index for the discount table
+        index = self.category_index if index is None else index
+        if isinstance(getattr(categories, 'dtype', None), pd.CategoricalDtype):
+            #Only the distinct labels need hashing, the rows just follow their categorical codes
+            categorical = pd.Categorical(categories)
+            rows = np.append(index.get_indexer(categorical.categories), -1)
+            return rows[categorical.codes]
+        return index.get_indexer(pd.Index(np.asarray(categories, dtype=object)))
+
+    @staticmethod
+    def _labels(table):
+        #Integer version of an answer table so batch output can be built as a categorical
+        labels = sorted({value for value in table.ravel() if value is not None})
+        lookup = {label: i for i, label in enumerate(labels)}
+        codes = np.array([lookup.get(value, -1) for value in table.ravel()], dtype=np.int64).reshape(table.shape)
+        return codes, labels
+
+    def price_buckets(self, prices, size):
+        if prices is None or self.segment_table.shape[1] == 1:
+            return np.zeros(size, dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.float64)
+        buckets = np.searchsorted(price_edges, prices, side='left')
+        return np.where(np.isnan(prices), 0, buckets) #Missing prices behave like no price given
+
+    def predict(self, category, price=None):
+        #Single lookup with the same output as predict_segment_and_state
+        if category not in self.predictions:
+            return self._reference_predict(category, {}, price)
+        answer = dict(self.predictions[category])
+        bucket = int(self.price_buckets([np.nan if price is None else price], 1)[0])
+        answer['best_segment'] = self.segment_table[self.category_index.get_loc(category), bucket]
+        return answer
+
+    def predict_optimal_discount(self, category):
+        code = self.codes([category], self.discount_index)[0]
+        return self.discount_table[code]
+
+    def predict_batch(self, categories, prices=None):
+        #Vectorized predictions for arrays or Series of categories and optional prices
+        #Segments and states come back as categoricals, unknown categories get missing values
+        codes = self.codes(categories)
+        if prices is not None and np.shape(prices) != (len(codes),):
+            raise ValueError(f"Got {len(codes)} categories but prices of shape {np.shape(prices)}, need one price per category")
+        discount_codes = self.codes(categories, self.discount_index)
+        buckets = self.price_buckets(prices, len(codes))
+        return pd.DataFrame({
+            'category': pd.Series(categories).to_numpy(),
+            'best_segment': pd.Categorical.from_codes(self.segment_codes[codes, buckets], self.segment_labels),
+            'best_state': pd.Categorical.from_codes(self.state_codes[codes], self.state_labels),
+            'optimal_discount': self.discount_table[discount_codes]
+        })
+
+def compile_predictor(results, optimal_discounts=None, rules='business'):
+    return CompiledPredictor(results, optimal_discounts, rules)
@@ -0,0 +1,153 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from aggregation import count_segments_states, merge_counts, build_results
+from datasets import read_csv_typed
+
+class SpaceSaving:
+    #Space-Saving heavy hitter summary holding at most capacity counters
+    #For a key in the summary, count - error <= true count <= count. Any key not in the summary
+    #occurred at most floor times. Built from one stream, floor <= total / capacity, so with
+    #capacity k every key above 1/k of the stream is guaranteed to be kept
+    def __init__(self, capacity=64):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.counts = pd.Series(dtype=np.int64)
+        self.errors = pd.Series(dtype=np.int64)
+        self.floor = 0
+        self.total = 0
+
+    @classmethod
+    def from_counts(cls, counts, capacity=64):
+        #Summary of exact counts, only the capacity largest are kept and the rest fold into floor
+        sketch = cls(capacity)
+        counts = counts[counts > 0].sort_values(ascending=False, kind='stable')
+        sketch.total = int(counts.sum())
+        if len(counts) > capacity:
+            sketch.floor = int(counts.iloc[capacity])
+            counts = counts.iloc[:capacity]
+        sketch.counts = counts.astype(np.int64)
+        sketch.errors = pd.Series(0, index=counts.index, dtype=np.int64)
+        return sketch
+
+    def update(self, keys):
+        #Absorbs a batch of keys, counted exactly with value_counts before being merged in
+        merged = self.merge(SpaceSaving.from_counts(pd.Series(keys).value_counts(), self.capacity))
+        self.counts, self.errors, self.floor, self.total = merged.counts, merged.errors, merged.floor, merged.total
+        return self
+
+    def merge(self, other):
+        #A key missing from one side may still have occurred there up to that side's floor, so that
+        #floor is added to both its count and its error. The largest capacity counters are kept
+        keys = self.counts.index.union(other.counts.index, sort=False)
+        counts = (self.counts.reindex(keys, fill_value=self.floor)
+                  + other.counts.reindex(keys, fill_value=other.floor))
+        errors = (self.errors.reindex(keys, fill_value=self.floor)
+                  + other.errors.reindex(keys, fill_value=other.floor))
+
+        merged = SpaceSaving(max(self.capacity, other.capacity))
+        merged.total = self.total + other.total
+        merged.floor = self.floor + other.floor
+
+        order = np.argsort(-counts.to_numpy(), kind='stable')
+        if len(order) > merged.capacity:
+            merged.floor = max(merged.floor, int(counts.iloc[order[merged.capacity]]))
+            order = order[:merged.capacity]
+        merged.counts = counts.iloc[order]
+        merged.errors = errors.iloc[order]
+        return merged
+
+    def top(self, n=5):
+        #(key, estimated count, error) for the n largest counters
+        return [(key, int(count), int(error))
+                for key, count, error in zip(self.counts.index[:n], self.counts.values[:n], self.errors.values[:n])]
+
+    def to_dict(self):
+        return {
+            'capacity': self.capacity,
+            'floor': self.floor,
+            'total': self.total,
+            'keys': [key.item() if isinstance(key, np.generic) else key for key in self.counts.index],
+            'counts': self.counts.tolist(),
+            'errors': self.errors.tolist()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['capacity'])
+        sketch.floor = data['floor']
+        sketch.total = data['total']
+        index = pd.Index(data['keys'], dtype=object)
+        sketch.counts = pd.Series(data['counts'], index=index, dtype=np.int64)
+        sketch.errors = pd.Series(data['errors'], index=index, dtype=np.int64)
+        return sketch
+
+class CategorySketches:
+    #One Space-Saving summary per category, memory is fixed by capacity however many keys there are
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.sketches = {}
+
+    def update(self, categories, keys):
+        #Counts each (category, key) pair of the batch exactly, then merges category by category
+        pairs = pd.DataFrame({'category': categories, 'key': keys}).dropna()
+        counts = pairs.value_counts(sort=False)
+        for category, category_counts in counts.groupby(level=0, sort=False, observed=True):
+            batch = SpaceSaving.from_counts(category_counts.droplevel(0), self.capacity)
+            current = self.sketches.get(category)
+            self.sketches[category] = batch if current is None else current.merge(batch)
+        return self
+
+    def merge(self, other):
+        merged = CategorySketches(max(self.capacity, other.capacity))
+        for category in list(self.sketches) + [c for c in other.sketches if c not in self.sketches]:
+            left, right = self.sketches.get(category), other.sketches.get(category)
+            merged.sketches[category] = left.merge(right) if left is not None and right is not None else (left or right)
+        return merged
+
+    def to_json(self):
+        return json.dumps({'capacity': self.capacity,
+                           'sketches': [[category, sketch.to_dict()] for category, sketch in self.sketches.items()]})
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        sketches = cls(data['capacity'])
+        sketches.sketches = {category: SpaceSaving.from_dict(sketch) for category, sketch in data['sketches']}
+        return sketches
+
+def approximate_top_states(sketch, total_category_records, top_n=5):
+    #Top states in the results format, each with its error bar from the sketch
+    top_states = []
+    for state, count, error in sketch.top(top_n):
+        percentage = round(count / total_category_records * 100, 2)
+        top_states.append({
+            'state': state,
+            'count': count,
+            'percentage': f"{percentage}%",
+            'count_lower_bound': count - error,
+            'percentage_error': round(error / total_category_records * 100, 2) #True share is at most this far below percentage
+        })
+    return top_states
+
+def approximate_segment_state_results(data_path, category_col='Category', segment_col='Customer_Segment',
+                                      state_col='Customer_State', capacity=64, chunksize=1_000_000,
+                                      schema=None, top_n=5):
+    #Streams the file keeping exact segment counts but only a fixed size sketch of states per category
+    counts = None
+    sketches = CategorySketches(capacity)
+    for chunk in read_csv_typed(data_path, schema, [category_col, segment_col, state_col], chunksize):
+        partial = count_segments_states(chunk, category_col, segment_col, None)
+        counts = partial if counts is None else merge_counts(counts, partial)
+        sketches.update(chunk[category_col], chunk[state_col])
+
+    if counts is None:
+        return {}
+    results = build_results(counts, top_n)
+    for category, result in results.items():
+        sketch = sketches.sketches.get(category, SpaceSaving(capacity))
+        result['top5_states'] = approximate_top_states(sketch, result['total_records'], top_n)
+    return results
@@ -2,78 +2,114 @@ import pandas as pd
 import numpy as np
 import random
 import uuid
+import os
+import shutil
+import glob
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor
 
-def generate_synthetic_data(num_records=1000):
-    #Combines the categories from each set
-    categories = [
-        "Office Supplies",
-        "Furniture",
-        "Technology",
-        "Books",
-        "Home & Kitchen",
-        "Electronics",
-        "Beauty",
-        "Toys",
-        "Clothing",
-        "Sports"
-    ]
-
-    #Defines the customer segments
-    customer_segments = ["Consumer", "Corporate", "Home Office"]
-
-    #Tells us our top customer states that are relevant
-    states_list = [
-        "California", "New York", "Texas", "Pennsylvania", "Washington",
-        "Illinois", "Florida", "Ohio", "Georgia", "Michigan"
-    ]
-
-    #Applies weighted probabilities to states that match it to real world distribution
-    #There are higher weights for states with more commercial activity
-    state_weights_raw = [0.20, 0.11, 0.10, 0.06, 0.05, 0.05, 0.04, 0.04, 0.03, 0.03]
-    state_weights = [w/sum(state_weights_raw) for w in state_weights_raw]  #Makes sure sums add up to 1
-
-    #Various product names for different categories
-    product_templates = {
-        "Office Supplies": ["Pen Set", "Notebook", "Paper Clips", "Stapler", "Binder", "Desk Organizer", "File Cabinet"],
-        "Furniture": ["Desk", "Chair", "Bookcase", "Table", "Sofa", "Cabinet", "Drawer"],
-        "Technology": ["Laptop", "Phone", "Tablet", "Monitor", "Keyboard", "Mouse", "Headphones"],
-        "Books": ["Novel", "Textbook", "Biography", "Cookbook", "Self-Help Book", "Reference Guide", "Children's Book"],
-        "Home & Kitchen": ["Blender", "Cookware", "Utensils", "Dinnerware", "Toaster", "Coffee Maker", "Knife Set"],
-        "Electronics": ["Television", "Camera", "Speaker", "Charger", "Smartwatch", "Gaming Console", "Printer"],
-        "Beauty": ["Makeup", "Skincare", "Haircare", "Fragrance", "Beauty Tool", "Nail Polish", "Face Mask"],
-        "Toys": ["Action Figure", "Board Game", "Puzzle", "Doll", "Building Blocks", "Remote Control Car", "Educational Toy"],
-        "Clothing": ["Shirt", "Pants", "Dress", "Jacket", "Sweater", "Shoes", "Accessories"],
-        "Sports": ["Ball", "Training Equipment", "Racket", "Shoes", "Apparel", "Protection Gear", "Fitness Tracker"]
-    }
-
-    #Different price ranges per category
-    price_ranges = {
-        "Office Supplies": (5, 100),
-        "Furniture": (50, 500),
-        "Technology": (100, 1000),
-        "Books": (10, 50),
-        "Home & Kitchen": (20, 200),
-        "Electronics": (50, 800),
-        "Beauty": (10, 150),
-        "Toys": (15, 80),
-        "Clothing": (20, 200),
-        "Sports": (15, 300)
-    }
-
-    #Gives us segment probabilities based off our analysis
-    segment_probabilities = {
-        "Office Supplies": {"Consumer": 0.52, "Corporate": 0.30, "Home Office": 0.18},
-        "Furniture": {"Consumer": 0.52, "Corporate": 0.31, "Home Office": 0.17},
-        "Technology": {"Consumer": 0.51, "Corporate": 0.30, "Home Office": 0.19},
-        "Books": {"Consumer": 0.52, "Corporate": 0.30, "Home Office": 0.18},
-        "Home & Kitchen": {"Consumer": 0.52, "Corporate": 0.31, "Home Office": 0.17},
-        "Electronics": {"Consumer": 0.51, "Corporate": 0.30, "Home Office": 0.19},
-        "Beauty": {"Consumer": 0.51, "Corporate": 0.30, "Home Office": 0.19},
-        "Toys": {"Consumer": 0.52, "Corporate": 0.30, "Home Office": 0.18},
-        "Clothing": {"Consumer": 0.52, "Corporate": 0.31, "Home Office": 0.17},
-        "Sports": {"Consumer": 0.52, "Corporate": 0.31, "Home Office": 0.17}
-    }
+from instrumentation import instrumented, stage
 
+#Combines the categories from each set
+categories = [
+    "Office Supplies",
+    "Furniture",
+    "Technology",
+    "Books",
+    "Home & Kitchen",
+    "Electronics",
+    "Beauty",
+    "Toys",
+    "Clothing",
+    "Sports"
+]
+
+#Defines the customer segments
+customer_segments = ["Consumer", "Corporate", "Home Office"]
+
+#Tells us our top customer states that are relevant
+states_list = [
+    "California", "New York", "Texas", "Pennsylvania", "Washington",
+    "Illinois", "Florida", "Ohio", "Georgia", "Michigan"
+]
+
+#Applies weighted probabilities to states that match it to real world distribution
+#There are higher weights for states with more commercial activity
+state_weights_raw = [0.20, 0.11, 0.10, 0.06, 0.05, 0.05, 0.04, 0.04, 0.03, 0.03]
+state_weights = [w/sum(state_weights_raw) for w in state_weights_raw]  #Makes sure sums add up to 1
+
+#Various product names for different categories
+product_templates = {
+    "Office Supplies": ["Pen Set", "Notebook", "Paper Clips", "Stapler", "Binder", "Desk Organizer", "File Cabinet"],
+    "Furniture": ["Desk", "Chair", "Bookcase", "Table", "Sofa", "Cabinet", "Drawer"],
+    "Technology": ["Laptop", "Phone", "Tablet", "Monitor", "Keyboard", "Mouse", "Headphones"],
+    "Books": ["Novel", "Textbook", "Biography", "Cookbook", "Self-Help Book", "Reference Guide", "Children's Book"],
+    "Home & Kitchen": ["Blender", "Cookware", "Utensils", "Dinnerware", "Toaster", "Coffee Maker", "Knife Set"],
+    "Electronics": ["Television", "Camera", "Speaker", "Charger", "Smartwatch", "Gaming Console", "Printer"],
+    "Beauty": ["Makeup", "Skincare", "Haircare", "Fragrance", "Beauty Tool", "Nail Polish", "Face Mask"],
+    "Toys": ["Action Figure", "Board Game", "Puzzle", "Doll", "Building Blocks", "Remote Control Car", "Educational Toy"],
+    "Clothing": ["Shirt", "Pants", "Dress", "Jacket", "Sweater", "Shoes", "Accessories"],
+    "Sports": ["Ball", "Training Equipment", "Racket", "Shoes", "Apparel", "Protection Gear", "Fitness Tracker"]
+}
+
+#Quality tiers appended to every product name
+product_tiers = ['Premium', 'Standard', 'Basic', 'Pro', 'Deluxe', 'Essential']
+
+#Different price ranges per category
+price_ranges = {
+    "Office Supplies": (5, 100),
+    "Furniture": (50, 500),
+    "Technology": (100, 1000),
+    "Books": (10, 50),
+    "Home & Kitchen": (20, 200),
+    "Electronics": (50, 800),
+    "Beauty": (10, 150),
+    "Toys": (15, 80),
+    "Clothing": (20, 200),
+    "Sports": (15, 300)
+}
+
+#Gives us segment probabilities based off our analysis
+segment_probabilities = {
+    "Office Supplies": {"Consumer": 0.52, "Corporate": 0.30, "Home Office": 0.18},
+    "Furniture": {"Consumer": 0.52, "Corporate": 0.31, "Home Office": 0.17},
+    "Technology": {"Consumer": 0.51, "Corporate": 0.30, "Home Office": 0.19},
+    "Books": {"Consumer": 0.52, "Corporate": 0.30, "Home Office": 0.18},
+    "Home & Kitchen": {"Consumer": 0.52, "Corporate": 0.31, "Home Office": 0.17},
+    "Electronics": {"Consumer": 0.51, "Corporate": 0.30, "Home Office": 0.19},
+    "Beauty": {"Consumer": 0.51, "Corporate": 0.30, "Home Office": 0.19},
+    "Toys": {"Consumer": 0.52, "Corporate": 0.30, "Home Office": 0.18},
+    "Clothing": {"Consumer": 0.52, "Corporate": 0.31, "Home Office": 0.17},
+    "Sports": {"Consumer": 0.52, "Corporate": 0.31, "Home Office": 0.17}
+}
+
+synthetic_columns = ['Customer_ID', 'Product_Name', 'Category', 'Customer_State', 'Customer_Segment', 'Price']
+
+#Lookup tables used by the vectorized generator, built once from the definitions above
+_category_array = np.array(categories, dtype=object)
+_segment_array = np.array(customer_segments, dtype=object)
+_state_array = np.array(states_list, dtype=object)
+_product_name_array = np.array([
+    f"{base} {tier}"
+    for category in categories
+    for base in product_templates[category]
+    for tier in product_tiers
+], dtype=object) #Indexed by (category, base product, tier)
+_templates_per_category = len(product_templates[categories[0]])
+_price_bounds = np.array([price_ranges[category] for category in categories], dtype=np.float64)
+_segment_cdf = np.cumsum(
+    [[segment_probabilities[category][segment] for segment in customer_segments] for category in categories],
+    axis=1
+)
+_segment_cdf[:, -1] = 1.0 #Guards against rounding leaving a tiny gap at the top of the distribution
+
+_hex_digits = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+_id_prefix = np.frombuffer(b"CUST-", dtype=np.uint8)
+_max_customer_ids = 2 ** 32
+
+def generate_synthetic_data_loop(num_records=1000):
+    #Original row-by-row generator, kept as the reference for benchmarks and distribution checks
     #Different lists to store our data
     customer_ids = []
     product_names = []
@@ -89,7 +125,7 @@ def generate_synthetic_data(num_records=1000):
         customer_id = f"CUST-{uuid.uuid4().hex[:8].upper()}"
 
         product_base = random.choice(product_templates[category])
-        product_name = f"{product_base} {random.choice(['Premium', 'Standard', 'Basic', 'Pro', 'Deluxe', 'Essential'])}"
+        product_name = f"{product_base} {random.choice(product_tiers)}"
 
         state = np.random.choice(states_list, p=state_weights)
 
@@ -121,11 +157,354 @@ def generate_synthetic_data(num_records=1000):
 
     return df
 
-if __name__ == "__main__":
-    #Generate the synthetic data
-    num_records = 5000
-    synthetic_data = generate_synthetic_data(num_records)
+def _id_key(seed):
+    #Derives the scrambling key for customer IDs from the seed so every run has its own ID space
+    return int(np.random.default_rng(seed).integers(0, _max_customer_ids, dtype=np.uint64))
+
+def _scramble(numbers, key):
+    #Invertible 32 bit mix, distinct numbers below 2**32 always come out distinct
+    x = (np.asarray(numbers, dtype=np.uint64) ^ np.uint64(key)) & np.uint64(0xFFFFFFFF)
+    x = (x * np.uint64(0x7FEB352D)) & np.uint64(0xFFFFFFFF)
+    x ^= x >> np.uint64(15)
+    x = (x * np.uint64(0x846CA68B)) & np.uint64(0xFFFFFFFF)
+    x ^= x >> np.uint64(16)
+    return x
+
+def _hex_bytes(values, digits=_hex_digits):
+    #Eight ascii hex digits per 32 bit value, as a (count, 8) byte array
+    shifts = np.arange(28, -4, -4, dtype=np.uint64)
+    return digits[(values[:, None] >> shifts) & np.uint64(0xF)]
+
+def _byte_strings(raw):
+    return raw.view(f'S{raw.shape[1]}').ravel().astype(str).astype(object)
+
+def _customer_ids(start, count, key):
+    #Scrambles consecutive record numbers, so IDs look random but never repeat
+    #Each one becomes "CUST-XXXXXXXX" by writing the ascii bytes directly
+    raw = np.empty((count, 13), dtype=np.uint8)
+    raw[:, :5] = _id_prefix
+    raw[:, 5:] = _hex_bytes(_scramble(np.arange(start, start + count), key))
+    return _byte_strings(raw)
+
+def _generate_chunk(rng, start, count, key):
+    #Draws every column of one chunk as whole arrays
+    category_codes = rng.integers(0, len(categories), size=count)
+
+    base_codes = rng.integers(0, _templates_per_category, size=count)
+    tier_codes = rng.integers(0, len(product_tiers), size=count)
+    name_codes = (category_codes * _templates_per_category + base_codes) * len(product_tiers) + tier_codes
+
+    state_codes = rng.choice(len(states_list), size=count, p=state_weights)
+
+    #Inverse CDF sampling against each row's own category distribution
+    draws = rng.random(count)
+    segment_codes = (draws[:, None] >= _segment_cdf[category_codes]).sum(axis=1)
+
+    low = _price_bounds[category_codes, 0]
+    high = _price_bounds[category_codes, 1]
+    price_values = np.round(rng.uniform(low, high), 2)
+
+    return pd.DataFrame({
+        'Customer_ID': _customer_ids(start, count, key),
+        'Product_Name': _product_name_array[name_codes],
+        'Category': _category_array[category_codes],
+        'Customer_State': _state_array[state_codes],
+        'Customer_Segment': _segment_array[segment_codes],
+        'Price': price_values
+    }, index=pd.RangeIndex(start, start + count))
+
+#Rows are drawn in fixed blocks, each from its own stream keyed by the block's position in the dataset,
+#so the rows for a seed are the same whatever chunk_size, shard_size or number of workers produced them
+rng_block_rows = 16_384
+
+def _block_rng(root, block):
+    return np.random.default_rng(np.random.SeedSequence(root.entropy, spawn_key=root.spawn_key + (block,)))
+
+def _blocked_chunks(generate_block, num_records, chunk_size, seed, id_offset):
+    #Yields chunks of the rows numbered id_offset to id_offset + num_records, generate_block(rng, start, count)
+    #draws one whole block and every chunk is cut from the blocks it overlaps
+    root = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    end = id_offset + num_records
+    cached = (None, None) #A block that straddles two chunks is only drawn once
+    for start in range(id_offset, end, chunk_size):
+        stop = min(start + chunk_size, end)
+        pieces = []
+        for block in range(start // rng_block_rows, (stop - 1) // rng_block_rows + 1):
+            if cached[0] != block:
+                cached = (block, generate_block(_block_rng(root, block), block * rng_block_rows, rng_block_rows))
+            block_start = block * rng_block_rows
+            pieces.append(cached[1].iloc[max(start - block_start, 0):stop - block_start])
+        yield pieces[0] if len(pieces) == 1 else pd.concat(pieces)
+
+def iter_synthetic_data(num_records=1000, chunk_size=1_000_000, seed=None, id_offset=0, id_seed=None):
+    #Yields DataFrames of at most chunk_size rows so memory stays bounded no matter how many records are asked for
+    #id_offset is the position of the first record in the whole dataset, it numbers the customer IDs and picks the
+    #random blocks the rows come from, so parts generated separately with one seed join into the same data
+    #id_seed picks the customer ID space (defaults to seed), parts that share it and use distinct offsets never collide
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    if id_offset + num_records > _max_customer_ids:
+        raise ValueError(f"Customer IDs are unique for at most {_max_customer_ids} records")
+
+    key = _id_key(seed if id_seed is None else id_seed)
+    generate_block = functools.partial(_generate_chunk, key=key)
+    yield from _blocked_chunks(generate_block, num_records, chunk_size, seed, id_offset)
+
+@instrumented('generate', rows=len)
+def generate_synthetic_data(num_records=1000, seed=None, chunk_size=1_000_000):
+    #Vectorized generator, same columns and distributions as generate_synthetic_data_loop
+    chunks = list(iter_synthetic_data(num_records, chunk_size=chunk_size, seed=seed))
+    if not chunks:
+        return pd.DataFrame({column: pd.Series(dtype=object if column != 'Price' else float) for column in synthetic_columns})
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks)
+
+#Transaction data in the 4thdataset.csv schema
+transaction_columns = ['User_ID', 'Product_ID', 'Category', 'Price (Rs.)', 'Discount (%)', 'Final_Price(Rs.)',
+                       'Payment_Method', 'Purchase_Date']
+transaction_categories = ['Sports', 'Clothing', 'Toys', 'Beauty', 'Books', 'Home & Kitchen', 'Electronics']
+payment_methods = ['Credit Card', 'UPI', 'Debit Card', 'Net Banking', 'Cash on Delivery']
+transaction_price_range = (10.0, 500.0)
+products_per_category = 500
+
+#Relative order volume by month (January first), a slow February and a November and December peak
+monthly_demand = [1.0, 0.85, 0.95, 0.95, 1.0, 1.0, 1.05, 1.05, 0.95, 1.05, 1.3, 1.5]
+weekend_demand = 1.15 #Saturdays and Sundays get this much more orders than weekdays
+
+_hex_digits_lower = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+
+def _discount_table(category_names, distributions, elasticity):
+    #Per category discount values and the cumulative probability of each, padded into one table
+    #Every value listed in a distribution is equally likely, then the demand response reweights it:
+    #an order at discount d is (1 - d/100) ** -elasticity times as likely, so elasticity 0 keeps the
+    #listed distribution and elasticity above 1 makes deeper discounts earn more revenue
+    from prediction import discount_distributions, default_discount_values
+    distributions = discount_distributions if distributions is None else distributions
+
+    rows = []
+    for category in category_names:
+        values, counts = np.unique(distributions.get(category, default_discount_values), return_counts=True)
+        response = elasticity.get(category, 0.0) if isinstance(elasticity, dict) else elasticity
+        weights = counts * (1 - values / 100) ** -response
+        rows.append((values, np.cumsum(weights) / weights.sum()))
+
+    width = max(len(values) for values, _ in rows)
+    values_table = np.zeros((len(rows), width), dtype=np.int64)
+    cdf_table = np.ones((len(rows), width))
+    for i, (values, cdf) in enumerate(rows):
+        values_table[i, :len(values)] = values
+        cdf_table[i, :len(cdf)] = cdf
+    cdf_table[:, -1] = 1.0
+    return values_table, cdf_table
+
+def _date_table(start_date, end_date, seasonality):
+    #Every day in the range with its formatted date and its probability of receiving an order
+    days = pd.date_range(start_date, end_date, freq='D')
+    if len(days) == 0:
+        raise ValueError("end_date must not be before start_date")
+    weights = np.asarray(seasonality if seasonality is not None else monthly_demand)[days.month - 1]
+    weights = weights * np.where(days.dayofweek >= 5, weekend_demand, 1.0)
+    return days.strftime('%d-%m-%Y').to_numpy(dtype=object), weights / weights.sum()
+
+def _generate_transaction_chunk(rng, start, count, key, category_names, discounts, dates):
+    discount_values, discount_cdf = discounts
+    date_labels, date_probabilities = dates
 
+    category_codes = rng.integers(0, len(category_names), size=count)
+    draws = rng.random(count)
+    discount_codes = (draws[:, None] >= discount_cdf[category_codes]).sum(axis=1)
+    discount_percent = discount_values[category_codes, discount_codes]
+
+    prices = np.round(rng.uniform(*transaction_price_range, size=count), 2)
+    final_prices = np.round(prices * (1 - discount_percent / 100), 2)
+
+    #Products are drawn from a fixed catalogue per category, so the same Product_ID repeats across orders
+    product_numbers = category_codes * products_per_category + rng.integers(0, products_per_category, size=count)
+    product_hash = _scramble(product_numbers, key ^ 0x5BD1E995)
+    product_raw = np.empty((count, 10), dtype=np.uint8)
+    product_raw[:, :8] = _hex_bytes(product_hash, _hex_digits_lower)
+    product_raw[:, 8] = ord('-')
+    product_raw[:, 9] = _hex_digits_lower[product_numbers % 16]
+
+    return pd.DataFrame({
+        'User_ID': _byte_strings(_hex_bytes(_scramble(np.arange(start, start + count), key), _hex_digits_lower)),
+        'Product_ID': _byte_strings(product_raw),
+        'Category': np.array(category_names, dtype=object)[category_codes],
+        'Price (Rs.)': prices,
+        'Discount (%)': discount_percent,
+        'Final_Price(Rs.)': final_prices,
+        'Payment_Method': np.array(payment_methods, dtype=object)[rng.integers(0, len(payment_methods), size=count)],
+        'Purchase_Date': date_labels[rng.choice(len(date_labels), size=count, p=date_probabilities)]
+    }, index=pd.RangeIndex(start, start + count))
+
+def iter_transaction_data(num_records=1000, chunk_size=1_000_000, seed=None, id_offset=0, id_seed=None,
+                          start_date='2024-01-01', end_date='2024-12-31', discount_elasticity=0.0,
+                          distributions=None, seasonality=None, category_names=None):
+    #Yields chunks of orders in the 4thdataset.csv schema
+    #discount_elasticity is one number or a {category: number} dict, see _discount_table
+    #seasonality is twelve relative monthly volumes, defaults to monthly_demand
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be positive")
+    if id_offset + num_records > _max_customer_ids:
+        raise ValueError(f"User IDs are unique for at most {_max_customer_ids} records")
+
+    category_names = list(category_names or transaction_categories)
+    discounts = _discount_table(category_names, distributions, discount_elasticity)
+    dates = _date_table(start_date, end_date, seasonality)
+
+    key = _id_key(seed if id_seed is None else id_seed)
+    generate_block = functools.partial(_generate_transaction_chunk, key=key, category_names=category_names,
+                                       discounts=discounts, dates=dates)
+    yield from _blocked_chunks(generate_block, num_records, chunk_size, seed, id_offset)
+
+@instrumented('generate', rows=len)
+def generate_transaction_data(num_records=1000, seed=None, chunk_size=1_000_000, **options):
+    #Vectorized transaction generator, options are passed on to iter_transaction_data
+    chunks = list(iter_transaction_data(num_records, chunk_size=chunk_size, seed=seed, **options))
+    if not chunks:
+        return pd.DataFrame({column: pd.Series(dtype=object) for column in transaction_columns})
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks)
+
+def _file_format(path, file_format):
+    if file_format is not None:
+        return file_format
+    return 'parquet' if os.path.splitext(path)[1].lower() in ('.parquet', '.pq') else 'csv'
+
+def write_chunks(chunks, output_path, file_format=None):
+    #Streams DataFrame chunks to a single CSV or Parquet file, returns the number of rows written
+    file_format = _file_format(output_path, file_format)
+    rows = 0
+
+    if file_format == 'csv':
+        with open(output_path, 'w', newline='') as handle:
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(handle, index=False, header=(i == 0))
+                rows += len(chunk)
+        return rows
+
+    if file_format == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Writing Parquet files requires pyarrow") from e
+
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table)
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows
+
+    raise ValueError(f"Unsupported file format: {file_format}")
+
+@instrumented('write', rows=lambda rows: rows)
+def write_synthetic_data(output_path, num_records=1000, chunk_size=1_000_000, seed=None, file_format=None, id_offset=0, id_seed=None):
+    #Generates and writes the data chunk by chunk, format is taken from the file extension unless given
+    chunks = iter_synthetic_data(num_records, chunk_size=chunk_size, seed=seed, id_offset=id_offset, id_seed=id_seed)
+    return write_chunks(chunks, output_path, file_format)
+
+@instrumented('write', rows=lambda rows: rows)
+def write_transaction_data(output_path, num_records=1000, chunk_size=1_000_000, seed=None, file_format=None,
+                           id_offset=0, id_seed=None, **options):
+    #Same as write_synthetic_data for transactions, usable as the writer of generate_sharded_data through
+    #functools.partial when options are needed
+    chunks = iter_transaction_data(num_records, chunk_size=chunk_size, seed=seed, id_offset=id_offset,
+                                   id_seed=id_seed, **options)
+    return write_chunks(chunks, output_path, file_format)
+
+def _write_shard(task):
+    #Runs inside a worker process, so it only takes plain picklable arguments
+    writer, path, num_records, chunk_size, seed, file_format, id_offset, id_seed = task
+    return writer(path, num_records, chunk_size=chunk_size, seed=seed, file_format=file_format,
+                  id_offset=id_offset, id_seed=id_seed)
+
+def concatenate_shards(shard_paths, output_path, file_format=None):
+    #Joins shard files in order into one file, CSV shards are copied byte for byte after the first header
+    file_format = _file_format(output_path, file_format)
+
+    if file_format == 'csv':
+        with open(output_path, 'wb') as out:
+            for i, shard_path in enumerate(shard_paths):
+                with open(shard_path, 'rb') as shard:
+                    if i > 0:
+                        shard.readline() #Skips the repeated header
+                    shutil.copyfileobj(shard, out, 16 * 1024 * 1024)
+        return output_path
+
+    if file_format == 'parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Writing Parquet files requires pyarrow") from e
+
+        writer = None
+        try:
+            for shard_path in shard_paths:
+                table = pq.read_table(shard_path)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        return output_path
+
+    raise ValueError(f"Unsupported file format: {file_format}")
+
+def generate_sharded_data(num_records, output_dir, shard_size=1_000_000, seed=None, workers=None,
+                          chunk_size=1_000_000, file_format='csv', combined_path=None, writer=None):
+    #Splits num_records into fixed size shards and writes them from a process pool into output_dir
+    #Every shard draws from the same SeedSequence at its global row offset, so the shards joined in order
+    #are the rows generate_synthetic_data gives for the seed, whatever shard_size and the number of workers
+    if shard_size <= 0:
+        raise ValueError("shard_size must be positive")
+    writer = writer or write_synthetic_data
+
+    seed_sequence = np.random.SeedSequence(seed)
+    num_shards = max(1, -(-num_records // shard_size))
+
+    os.makedirs(output_dir, exist_ok=True)
+    extension = 'parquet' if file_format == 'parquet' else 'csv'
+
+    #Shards left by an earlier run with more of them would otherwise be read back as part of this one
+    for stale_path in glob.glob(os.path.join(output_dir, 'part-*.csv')) + glob.glob(os.path.join(output_dir, 'part-*.parquet')):
+        os.remove(stale_path)
+
+    tasks = []
+    for shard in range(num_shards):
+        start = shard * shard_size
+        count = min(shard_size, num_records - start)
+        path = os.path.join(output_dir, f"part-{shard:05d}.{extension}")
+        #All shards share the root entropy as their ID space and use their global start as the offset
+        tasks.append((writer, path, count, chunk_size, seed_sequence, file_format, start, seed_sequence.entropy))
+
+    if workers == 1 or num_shards == 1:
+        for task in tasks:
+            _write_shard(task)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_write_shard, tasks))
+
+    shard_paths = [task[1] for task in tasks]
+    if combined_path is not None:
+        concatenate_shards(shard_paths, combined_path, file_format)
+
+    return shard_paths
+
+#Largest run whose distributions main reads back and prints
+summary_max_records = 1_000_000
+
+def print_summary(synthetic_data):
     print("\nCategory distribution:")
     category_counts = synthetic_data['Category'].value_counts()
     for category, count in category_counts.items():
@@ -141,5 +520,50 @@ if __name__ == "__main__":
     for state, count in state_counts.items():
         print(f"{state}: {count}")
 
-    synthetic_data.to_csv('synthetic_ecommerce_data.csv', index=False)
-    print("\nSaved synthetic data to 'synthetic_ecommerce_data.csv'")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates the synthetic e-commerce dataset")
+    parser.add_argument('--records', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--output', default=None,
+                        help="Defaults to synthetic_ecommerce_data.csv, or transaction_data.csv with --transactions")
+    parser.add_argument('--shards-dir', default=None, help="Writes partitioned shards here using a process pool")
+    parser.add_argument('--shard-size', type=int, default=1_000_000)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--format', choices=['csv', 'parquet'], default=None, help="Defaults to the --output extension")
+    parser.add_argument('--combined', action='store_true', help="Also concatenates the shards into --output")
+    parser.add_argument('--transactions', action='store_true', help="Generates orders in the 4thdataset.csv schema instead")
+    parser.add_argument('--elasticity', type=float, default=0.0, help="Demand response to discount for --transactions")
+    parser.add_argument('--start-date', default='2024-01-01')
+    parser.add_argument('--end-date', default='2024-12-31')
+    args = parser.parse_args()
+    #Transactions get their own default so they never overwrite the file prediction.py reads
+    args.output = args.output or ('transaction_data.csv' if args.transactions else 'synthetic_ecommerce_data.csv')
+    file_format = _file_format(args.output, args.format)
+
+    transaction_options = {'discount_elasticity': args.elasticity, 'start_date': args.start_date, 'end_date': args.end_date}
+    if args.shards_dir:
+        writer = functools.partial(write_transaction_data, **transaction_options) if args.transactions else None
+        shard_paths = generate_sharded_data(
+            args.records, args.shards_dir, shard_size=args.shard_size, seed=args.seed, workers=args.workers,
+            file_format=file_format, combined_path=args.output if args.combined else None, writer=writer
+        )
+        print(f"Wrote {args.records} records to {len(shard_paths)} shards in '{args.shards_dir}'")
+        if args.combined:
+            print(f"Saved combined data to '{args.output}'")
+    elif args.transactions:
+        #Streams straight to disk, so any number of records fits in memory
+        rows = write_transaction_data(args.output, args.records, seed=args.seed, file_format=file_format,
+                                      **transaction_options)
+        print(f"Saved {rows} transactions to '{args.output}'")
+    else:
+        #Generate the synthetic data straight to disk, so any number of records fits in memory
+        rows = write_synthetic_data(args.output, args.records, seed=args.seed, file_format=file_format)
+
+        #The distributions are read back from the file, only for runs small enough to load whole
+        if rows <= summary_max_records:
+            with stage('render', 'synthetic_data.main', rows):
+                print_summary(pd.read_parquet(args.output) if file_format == 'parquet' else pd.read_csv(args.output))
+        else:
+            print(f"\nSummary skipped for more than {summary_max_records:,} records")
+        print(f"\nSaved synthetic data to '{args.output}'")
+